@@ -0,0 +1,191 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from typing import cast
+
+from vbuild import bash
+from vbuild.apkbuild import (
+    APKBUILD_AUTOMATIC_VARIABLES,
+    put_variables,
+    quoted_string,
+)
+from vbuild.velbuild import VELBUILD
+from vbuild.velbuild import parse as parse_velbuild
+
+Result = dict[str, float | int | list[float]]
+
+
+def _strings(velbuild: VELBUILD) -> list[str]:
+    strings: list[str] = []
+    for value in velbuild.variables.values():
+        if isinstance(value, str):
+            strings.append(value)
+
+        elif isinstance(value, list):
+            strings.extend(x for x in value if x is not None)
+
+        elif isinstance(value, dict):
+            strings.extend(value.values())
+
+    return strings
+
+
+def _copy(velbuild: VELBUILD) -> VELBUILD:
+    # Rendered views are memoized until the package changes, start from a copy
+    # so every call renders again
+    return VELBUILD(velbuild.variables, velbuild.functions)
+
+
+def benchmarks(path: str, tmpdir: str) -> dict[str, Callable[[], object]]:
+    with open(path) as f:
+        src = f.read()
+
+    velbuild = parse_velbuild(path)
+    strings = _strings(velbuild)
+    return {
+        "bash.parse": lambda: bash.parse(src, APKBUILD_AUTOMATIC_VARIABLES),
+        "velbuild.parse": lambda: parse_velbuild(path),
+        "quoted_string": lambda: [quoted_string(x) for x in strings],
+        "put_variables": lambda: put_variables(velbuild.variables),
+        "VELBUILD.text": lambda: _copy(velbuild).text,
+        "VELBUILD.subpackages": lambda: _copy(velbuild).subpackages,
+        "VELBUILD.save": lambda: _copy(velbuild).save(tmpdir),
+    }
+
+
+def measure(func: Callable[[], object], warmup: int, repeat: int) -> Result:
+    for _ in range(warmup):
+        _ = func()
+
+    times: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _ = func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "max": max(times),
+        "times": times,
+    }
+
+
+def run(args: argparse.Namespace) -> int:
+    VELBUILD.runtime = cast(str, args.runtime)  # pyright: ignore[reportAttributeAccessIssue]
+    paths = cast(list[str], args.paths) or sorted(glob.glob("tests/*/VELBUILD"))
+    name_filter = cast(str | None, args.filter)
+    results: dict[str, Result] = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for path in paths:
+            package = os.path.basename(os.path.dirname(path))
+            for name, func in benchmarks(path, tmpdir).items():
+                key = f"{package}:{name}"
+                if name_filter is not None and name_filter not in key:
+                    continue
+
+                result = measure(func, cast(int, args.warmup), cast(int, args.repeat))
+                results[key] = result
+                print(
+                    f"{key:<40} {cast(float, result['median']) * 1000:10.3f} ms"
+                    + f" ± {cast(float, result['stdev']) * 1000:.3f}",
+                    file=sys.stderr,
+                )
+
+    output = cast(str | None, args.json)
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "runtime": args.runtime,  # pyright: ignore[reportAny]
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    old_path, new_path = cast(list[str], args.compare)
+    threshold = cast(float, args.threshold)
+    with open(old_path) as f:
+        old = cast(dict[str, Result], json.load(f)["results"])
+
+    with open(new_path) as f:
+        new = cast(dict[str, Result], json.load(f)["results"])
+
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        before = cast(float, old[key]["median"])
+        after = cast(float, new[key]["median"])
+        change = after / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = " REGRESSION"
+            regressions += 1
+
+        print(
+            f"{key:<40} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms"
+            + f" {change:+7.1%}{flag}"
+        )
+
+    for key in sorted(old.keys() - new.keys()):
+        print(f"{key:<40} missing from {new_path}")
+
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing and rendering of VELBUILD files"
+    )
+    _ = parser.add_argument(
+        "paths",
+        help="VELBUILD files to benchmark, defaults to every one in tests/",
+        nargs="*",
+    )
+    _ = parser.add_argument("--warmup", type=int, default=2)
+    _ = parser.add_argument("--repeat", type=int, default=10)
+    _ = parser.add_argument("--filter", help="Only run benchmarks containing FILTER")
+    _ = parser.add_argument("--json", help="Write the results to FILE", metavar="FILE")
+    _ = parser.add_argument(
+        "--runtime",
+        help="Container runtime to render for, no container engine is used",
+        choices=["podman", "docker"],
+        default="podman",
+    )
+    _ = parser.add_argument(
+        "--compare",
+        help="Compare two --json results instead of running the benchmarks",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+    )
+    _ = parser.add_argument(
+        "--threshold",
+        help="Slowdown of the median that --compare reports as a regression",
+        type=float,
+        default=0.1,
+    )
+    args = parser.parse_args()
+    if args.compare is not None:  # pyright: ignore[reportAny]
+        return compare(args)
+
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from typing import cast
+
+from vbuild.apkbuild import quoted_string
+from vbuild.velbuild import VELBUILD
+from vbuild.velbuild import parse as parse_velbuild
+
+SIZES = {
+    "subpackages": [4, 8, 16, 32, 64],
+    "sources": [50, 100, 200, 400, 800],
+    "body": [250, 500, 1000, 2000, 4000],
+}
+# Sizes at the end used for the second fit, fewer than three follows noise
+TAIL = 3
+# Seconds, anything faster than this is mostly timer noise
+NOISE_FLOOR = 0.001
+
+
+def generate(subpackages: int = 1, sources: int = 1, body: int = 1) -> str:
+    lines = [
+        'maintainer="Stress Test <stress@example.com>"',
+        "pkgname=stress",
+        "pkgver=1.0.0",
+        "pkgrel=0",
+        'pkgdesc="Synthetic package"',
+        'upstream_author="nobody"',
+        'category="utilities"',
+        'url="https://example.com/"',
+        'arch="noarch"',
+        'license="MIT"',
+        '_commit="0123456789abcdef"',
+        'subpackages="',
+        *(f"\tstress-sub{i}:_sub{i}" for i in range(subpackages)),
+        '"',
+        'source="',
+        *(
+            f"file{i}.tar.gz::https://example.com/$_commit/$pkgname-{i}.tar.gz"
+            for i in range(sources)
+        ),
+        '"',
+        "",
+        "package() {",
+        '\tcat > "$pkgdir"/README <<-EOF',
+        *(f"\t\tLine {i} of $pkgname at version ${{pkgver}}" for i in range(body)),
+        "\tEOF",
+        "}",
+        "",
+        "postinstall() {",
+        '\techo "installed"',
+        "}",
+    ]
+    for i in range(subpackages):
+        lines.extend(
+            [
+                "",
+                f"_sub{i}() {{",
+                f'\tpkgdesc="Subpackage {i}"',
+                '\tdepends="$pkgname"',
+                "\tpackage() {",
+                f'\t\tinstall -Dm644 "$srcdir"/file{i} "$subpkgdir"/file{i}',
+                "\t}",
+                "}",
+            ]
+        )
+
+    lines.append(
+        'sha512sums="\n'
+        + "".join(f"{'0' * 128}  file{i}.tar.gz\n" for i in range(sources))
+        + '"'
+    )
+    return "\n".join(lines) + "\n"
+
+
+def operations(src: str, tmpdir: str) -> dict[str, Callable[[], object]]:
+    path = os.path.join(tmpdir, "VELBUILD")
+    with open(path, "w") as f:
+        _ = f.write(src)
+
+    velbuild = parse_velbuild(path)
+    # Rendered views are memoized until the package changes, so each call
+    # starts from a copy to render again
+    return {
+        "parse": lambda: parse_velbuild(path),
+        "text": lambda: VELBUILD(velbuild.variables, velbuild.functions).text,
+        "subpackages": lambda: (
+            VELBUILD(velbuild.variables, velbuild.functions).subpackages
+        ),
+        "quoted_string": lambda: quoted_string(src),
+    }
+
+
+def best(func: Callable[[], object], repeat: int) -> float:
+    times: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _ = func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def exponent(sizes: list[int], times: list[float]) -> float:
+    # Slope of the least squares fit of log(time) against log(size), 1 is
+    # linear and 2 is quadratic
+    xs = [math.log(x) for x in sizes]
+    ys = [math.log(max(x, 1e-9)) for x in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys, strict=True)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Check how parsing and rendering scale with the size of a VELBUILD"
+    )
+    _ = parser.add_argument("--repeat", type=int, default=5)
+    _ = parser.add_argument(
+        "--max-exponent",
+        help="Fail when time grows faster than size to this power",
+        type=float,
+        default=1.3,
+    )
+    _ = parser.add_argument(
+        "--dimension",
+        help="Only vary this dimension",
+        choices=list(SIZES.keys()),
+        action="append",
+    )
+    _ = parser.add_argument(
+        "--write",
+        help="Write the largest VELBUILD of each dimension to DIR instead",
+        metavar="DIR",
+    )
+    args = parser.parse_args()
+    VELBUILD.runtime = "podman"
+    dimensions = cast(list[str] | None, args.dimension) or list(SIZES.keys())
+    output = cast(str | None, args.write)
+    if output is not None:
+        for dimension in dimensions:
+            directory = os.path.join(output, f"stress-{dimension}")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, "VELBUILD"), "w") as f:
+                _ = f.write(generate(**{dimension: SIZES[dimension][-1]}))
+
+        return 0
+
+    max_exponent = cast(float, args.max_exponent)
+    failed = False
+    for dimension in dimensions:
+        sizes = SIZES[dimension]
+        results: dict[str, list[float]] = {}
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                src = generate(**{dimension: size})
+                for name, func in operations(src, tmpdir).items():
+                    results.setdefault(name, []).append(
+                        best(func, cast(int, args.repeat))
+                    )
+
+        for name, times in results.items():
+            # The fixed cost of starting bash hides growth at small sizes, so
+            # also fit the largest sizes. A single slow run can push one fit
+            # over the bound, only fail when both are
+            overall = exponent(sizes, times)
+            tail = exponent(sizes[-TAIL:], times[-TAIL:])
+            status = "ok"
+            if times[-1] < NOISE_FLOOR:
+                status = "too fast to tell"
+
+            elif min(overall, tail) > max_exponent:
+                status = "FAIL"
+                failed = True
+
+            print(
+                f"{dimension:<12} {name:<14} "
+                + " ".join(f"{x * 1000:9.2f}" for x in times)
+                + f" ms  O(n^{overall:.2f}), O(n^{tail:.2f}) at the end {status}"
+            )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
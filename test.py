@@ -1,18 +1,61 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import sys
+import tarfile
+import tempfile
+import time
 import traceback
+import zipfile
 from collections.abc import Callable
 from typing import Any
 
+from vbuild import (
+    abuild,
+    bash,
+    budget,
+    host,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+    trace,
+)
+from vbuild.abuild import derived_builder_tag
 from vbuild.apkbuild import (
     APKBUILD,
     Property,
     is_type,  # noqa: F401  # pyright: ignore[reportUnusedImport]
     quoted_string,
+    quoted_strings,
+)
+from vbuild.bulk import discover  # noqa: F401  # pyright: ignore[reportUnusedImport]
+from vbuild.cli.watch import first_stage  # noqa: F401  # pyright: ignore[reportUnusedImport]
+from vbuild.distfiles import (
+    checksums,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+    sha512,
+    sources,  # pyright: ignore[reportUnusedImport]
+)
+from vbuild.metrics import render
+from vbuild.model import (
+    ModelError,
+    from_bytes,
+    from_json,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+    to_bytes,
+    to_json,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+)
+from vbuild.stages import (
+    clear_stamps,
+    load_state,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+    save_state,
+    skip_reason,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+    stamp,
+    up_to_date,  # noqa: F401  # pyright: ignore[reportUnusedImport]
+)
+from vbuild.substeps import (
+    SubstepTimer,
+    classify,
 )
 from vbuild.velbuild import VELBUILD
+from vbuild.velbuild import parse as parse_velbuild
+from vbuild.watch import PollingWatcher
 
 FAILED = False
 
@@ -138,6 +181,210 @@ _assert('quoted_string("\'") == "\\"\\\'\\""', lambda: quoted_string("'"))
 _assert(
     "quoted_string(\"it's\") == \"'it'\\\"'\\\"'s'\"", lambda: quoted_string("it's")
 )
+_assert(
+    'quoted_strings(["x", None, "$srcdir/x"]) == ["\'x\'", "$srcdir\'/x\'"]',
+    lambda: quoted_strings(["x", None, "$srcdir/x"]),
+)
+tag = derived_builder_tag("sha256:0123456789abcdef", ["a", "b"], "noarch")
+_assert(
+    'tag == derived_builder_tag("sha256:0123456789abcdef", ["b", "a", "a"], "noarch")'
+)
+_assert('tag != derived_builder_tag("sha256:0123456789abcdef", ["a", "b"], "aarch64")')
+_assert('tag.startswith("0123456789ab-")')
+home = os.environ["HOME"]
+with tempfile.TemporaryDirectory() as tmpdir:
+    os.environ["HOME"] = tmpdir
+    _assert("not abuild._failed_derived_builder(tag)")
+    abuild._fail_derived_builder(tag)  # pyright: ignore[reportPrivateUsage]
+    _assert("abuild._failed_derived_builder(tag)")
+    _assert('not abuild._failed_derived_builder(tag.replace("a", "b", 1))')
+    abuild._fail_derived_builder("fedcba987654-" + tag[13:])  # pyright: ignore[reportPrivateUsage]
+    _assert("not abuild._failed_derived_builder(tag)")
+    os.environ["HOME"] = home
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    old = time.time() - 31 * 86400
+    for name in ("musl-1.2.5-r0.0a1b2c3d.apk", "zlib-1.3-r0.4e5f6a7b.apk"):
+        open(os.path.join(tmpdir, name), "w").close()
+        os.utime(os.path.join(tmpdir, name), (time.time(), old))
+
+    _ = abuild._print_logs(iter([b"(1/1) Installing musl (1.2.5-r0)\n"]))  # pyright: ignore[reportPrivateUsage]
+    _assert('abuild.used_apks == {"musl-1.2.5-r0"}')
+    abuild.evict_apk_cache(tmpdir, 30)
+    _assert('sorted(os.listdir(tmpdir)) == ["musl-1.2.5-r0.0a1b2c3d.apk"]')
+    _assert("not abuild.used_apks")
+
+step = classify("Installing for build: build-base")
+_assert('step == "installing makedepends"')
+_assert('classify("Running split function doc...") == "packaging subpackages"')
+_assert('classify("Signing the index...") == "signing"')
+_assert('classify("Something else") is None')
+timer = SubstepTimer("test", "build")
+timer.feed(">>> test: Unpacking /var/cache/distfiles/test.tar.gz...")
+timer.feed("some build output")
+timer.feed(">>> test*: Preparing package test...")
+substeps = timer.finish()
+_assert(
+    '[x.name for x in substeps] == ["build", "unpacking", "creating packages"]',
+    lambda: substeps,
+)
+text = render({'["vbuild_builds_total", {"result": "success"}]': 2}, {})
+_assert(
+    'text == "# HELP vbuild_builds_total vbuild commands run, by result\\n"'
+    + ' + "# TYPE vbuild_builds_total counter\\n"'
+    + """ + 'vbuild_builds_total{result="success"} 2\\n'""",
+    lambda: text,
+)
+_assert('"tests/subpackages" in discover("tests")')
+_assert('discover("tests/subpackages") == ["tests/subpackages"]')
+
+
+def _gen(directory: str, processes: int) -> None:
+    with budget.limit(subprocess=processes, daemon=0, network=0):
+        _ = parse_velbuild(os.path.join(directory, "VELBUILD")).text
+
+
+# One bash call to parse the VELBUILD, and two for each subpackage function:
+# alone, and with the package's variables in scope
+_assert('_gen("tests/basic", 1) is None')
+_assert('_gen("tests/subpackages", 1 + 2 * 5) is None')
+_raises('_gen("tests/subpackages", 2 * 5)', budget.BudgetExceededError)
+listeners = trace.listeners
+_assert("not listeners", lambda: listeners)
+escaped = r"a\tb\101\x42\303\251\\"
+_assert('bash.ansi_c_string(escaped) == "a\\tbABé\\\\"')
+velbuild = parse_velbuild("tests/subpackages/VELBUILD")
+text = velbuild.text
+data = to_bytes(velbuild)
+with budget.limit(subprocess=0):
+    loaded = from_bytes(data)
+    _assert("loaded.text == text")
+    _assert("from_json(to_json(velbuild)).text == text")
+
+_raises("from_bytes(data[:-1])", ModelError)
+_raises('from_bytes(data[:6] + b"S\\x01\\xff")', ModelError)
+_raises('from_bytes(data[:6] + b"L\\x01" * 100000 + b"N")', ModelError)
+_raises('from_json("{")', ModelError)
+_raises('from_json("[]")', ModelError)
+_raises('from_json(\'{"format": "vbuild-model", "version": 1}\')', ModelError)
+_assert(
+    '[x.name for x in sources(velbuild, "tests/subpackages")][:2]'
+    + ' == ["extensions-aarch64.zip", "extensions-arm32-testing.zip"]',
+    lambda: [x.name for x in sources(velbuild, "tests/subpackages")],
+)
+with open("tests/checksums/validate.sh", "rb") as f:
+    sha512sum = hashlib.sha512(f.read()).hexdigest()
+
+with budget.limit(network=0, daemon=0):
+    _assert(
+        'checksums(APKBUILD({"source": "validate.sh"}, {}), "tests/checksums")'
+        + ' == [(sha512sum, "validate.sh")]'
+    )
+with tempfile.TemporaryDirectory() as tmpdir:
+    os.makedirs(os.path.join(tmpdir, "data"))
+    with open(os.path.join(tmpdir, "data", "file"), "w") as f:
+        _ = f.write("test")
+
+    with tarfile.open(os.path.join(tmpdir, "data.tar.gz"), "w:gz") as archive:
+        archive.add(os.path.join(tmpdir, "data"), "data")
+
+    sha512sum = sha512(os.path.join(tmpdir, "data.tar.gz"))
+    apkbuild = APKBUILD(
+        {"pkgname": "test", "source": "data.tar.gz", "sha512sums": "0  data.tar.gz"},
+        {},
+    )
+    _assert("host.unpack(apkbuild, tmpdir) is None")
+    apkbuild.variables["sha512sums"] = f"{sha512sum}  data.tar.gz"
+    with budget.limit(subprocess=0, daemon=0):
+        _assert("host.unpack(apkbuild, tmpdir) == 0")
+        _assert('os.path.exists(os.path.join(tmpdir, "src", "data", "file"))')
+        _assert("host.clean(apkbuild, tmpdir) == 0")
+        _assert('not os.path.exists(os.path.join(tmpdir, "src"))')
+
+    apkbuild.functions["unpack"] = "true"
+    _assert("host.unpack(apkbuild, tmpdir) is None")
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    with zipfile.ZipFile(os.path.join(tmpdir, "data.zip"), "w") as archive:
+        info = zipfile.ZipInfo("data/run")
+        info.external_attr = 0o100755 << 16
+        archive.writestr(info, "#!/bin/sh\n")
+        info = zipfile.ZipInfo("data/link")
+        info.external_attr = 0o120777 << 16
+        archive.writestr(info, "run")
+
+    with zipfile.ZipFile(os.path.join(tmpdir, "evil.zip"), "w") as archive:
+        archive.writestr("../evil", "")
+
+    zipped = APKBUILD(
+        {
+            "pkgname": "test",
+            "source": "data.zip",
+            "sha512sums": f"{sha512(os.path.join(tmpdir, 'data.zip'))}  data.zip",
+        },
+        {},
+    )
+    _assert("host.unpack(zipped, tmpdir) == 0")
+    _assert('os.readlink(os.path.join(tmpdir, "src", "data", "link")) == "run"')
+    _assert('os.access(os.path.join(tmpdir, "src", "data", "run"), os.X_OK)')
+    zipped.variables["source"] = "evil.zip"
+    zipped.variables["sha512sums"] = (
+        f"{sha512(os.path.join(tmpdir, 'evil.zip'))}  evil.zip"
+    )
+    _assert("host.unpack(zipped, tmpdir) == 1")
+    _assert('not os.path.exists(os.path.join(tmpdir, "evil"))')
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    apkbuild = APKBUILD(
+        {"source": "fix.patch", "sha512sums": "0  fix.patch"}, {"build": "make"}
+    )
+    os.makedirs(os.path.join(tmpdir, "src"))
+    _assert("up_to_date(apkbuild, tmpdir) == []")
+    for stage in ("unpack", "prepare", "build"):
+        stamp(apkbuild, tmpdir, stage)
+
+    _assert(
+        'up_to_date(apkbuild, tmpdir) == ["clean", "fetch", "unpack", "prepare", "build"]'
+    )
+    apkbuild.functions["build"] = "make all"
+    _assert('up_to_date(apkbuild, tmpdir) == ["clean", "fetch", "unpack", "prepare"]')
+    apkbuild.functions["prepare"] = "default_prepare"
+    _assert("up_to_date(apkbuild, tmpdir) == []")
+    with open(os.path.join(tmpdir, "VELBUILD"), "w") as f:
+        _ = f.write("pkgname=test\n")
+
+    _assert("load_state(tmpdir) is None")
+    save_state(tmpdir, ["gen", "validate"])
+    _assert('load_state(tmpdir) == ["gen", "validate"]')
+    with open(os.path.join(tmpdir, "VELBUILD"), "a") as f:
+        _ = f.write("pkgver=1.0\n")
+
+    _assert("load_state(tmpdir) is None")
+    clear_stamps(tmpdir)
+    _assert('not os.path.exists(os.path.join(tmpdir, ".vbuild"))')
+
+before = APKBUILD({"source": "fix.patch"}, {"build": "make", "package": "true"})
+after = APKBUILD({"source": "fix.patch"}, {"build": "make", "package": "false"})
+_assert('first_stage({"velbuild"}, before, after) == "rootpkg"')
+_assert('first_stage({"velbuild", "source"}, before, after) == "build"')
+_assert('first_stage({"unpacked"}, before, after) == "clean"')
+after.functions["build"] = "make all"
+_assert('first_stage({"velbuild"}, before, after) == "build"')
+after.variables["source"] = "fix.patch other.patch"
+_assert('first_stage({"velbuild"}, before, after) == "clean"')
+_assert('first_stage({"velbuild"}, None, after) == "clean"')
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "VELBUILD")
+    with open(path, "w") as f:
+        _ = f.write("pkgname=test\n")
+
+    watcher = PollingWatcher([path], interval=0.01)
+    with open(path, "a") as f:
+        _ = f.write("pkgver=1.0\n")
+
+    _assert("watcher.wait() == [path]")
+
 _isinstance("APKBUILD.maintainer", Property)
 _isinstance("APKBUILD.arch", Property)
 apkbuild = APKBUILD({}, {})
@@ -154,7 +401,69 @@ _raises('setattr(apkbuild, "arch", "test")', AssertionError)
 _assert("apkbuild.text.strip() == \"maintainer='test'\\narch='\\ntest\\n'\"")
 apkbuild.arch = ["test", "test2"]
 _assert('apkbuild.arch == ["test", "test2"]')
+apkbuild.arch.append("test3")
+_assert('apkbuild.arch == ["test", "test2"]')
 _assert("apkbuild.text.strip() == \"maintainer='test'\\narch='\\ntest\\ntest2\\n'\"")
+apkbuild = APKBUILD(
+    {
+        "pkgname": "test",
+        "pkgver": "1.0_rc1",
+        "pkgrel": "0",
+        "pkgdesc": "Test",
+        "url": "https://example.com",
+        "license": "MIT",
+        "arch": "noarch",
+        "options": "!check",
+        "source": "test.tar.gz::https://example.com/v1.0_rc1.tar.gz",
+        "sha512sums": "0  test.tar.gz",
+    },
+    {"package": ""},
+)
+_assert("not list(apkbuild.sanitycheck())", lambda: list(apkbuild.sanitycheck()))
+apkbuild.variables["pkgver"] = "1.0-1"
+apkbuild.variables["install"] = "test.post-install other.pre-install test.install"
+apkbuild.variables["sha512sums"] = "0  test.tar.gz\n0  other.tar.gz"
+del apkbuild.variables["options"]
+_assert(
+    "[x for _, x in apkbuild.sanitycheck()] == ["
+    + '"1.0-1-r0 is not a valid version",'
+    + '"other.pre-install: install script does not match pkgname or any subpackage",'
+    + '"test.install: unknown install script suffix",'
+    + '"other.tar.gz exists in sha512sums but is missing in $source",'
+    + '"Testsuites (abuild check) are required or need to be explicitly disabled!",'
+    + "]",
+    lambda: list(apkbuild.sanitycheck()),
+)
+apkbuild.variables["arch"] = "noarch x86_64 arm-v7"
+apkbuild.variables["depends"] = (
+    "foo>=1.0 so:libfoo.so.1 !bar /bin/sh cmd:sh pc:zlib>=1.2 foo@testing foo>>1"
+)
+_assert(
+    "[x for _, x in apkbuild.sanitycheck()][1:4] == ["
+    + '"arm-v7 is not a valid arch",'
+    + '"noarch cannot be combined with other arches",'
+    + '"foo>>1 in depends is not a valid dependency",'
+    + "]",
+    lambda: list(apkbuild.sanitycheck()),
+)
+apkbuild.variables["arch"] = "noarch"
+del apkbuild.variables["depends"]
+_assert('skip_reason(apkbuild, "prepare") is not None')
+_assert('skip_reason(apkbuild, "build") == "no build() function"')
+_assert('skip_reason(apkbuild, "check") == "no check() function"')
+_assert('skip_reason(apkbuild, "rootpkg") is None')
+source = "test.tar.gz::https://example.com/v1.0_rc1.tar.gz"
+apkbuild.variables["source"] = f"{source}\nfix.patch"
+apkbuild.variables["options"] = "!check"
+_assert('skip_reason(apkbuild, "prepare") is None')
+_assert('skip_reason(apkbuild, "check") == "!check is set in options"')
+apkbuild = APKBUILD({"pkgname": "test", "subpackages": "test-doc"}, {})
+_assert('apkbuild._subpackages == {"test-doc": "doc"}')
+apkbuild.variables["subpackages"] = "test-doc test-dev:_dev"
+_assert(
+    'apkbuild._subpackages == {"test-doc": "doc", "test-dev": "_dev"}',
+    lambda: apkbuild._subpackages,
+)
 _isinstance("VELBUILD.image", property)
 velbuild = VELBUILD({}, {})
 _assert("velbuild.image is None")
@@ -179,6 +488,30 @@ velbuild.variables["options"] += "\nstrip"
 _assert('set(velbuild.options) == {"!tracedeps"}', lambda: set(velbuild.options))
 velbuild.variables["options"] += "\ntracedeps"
 _assert("not velbuild.options", lambda: set(velbuild.options))
+declared = VELBUILD({"options": None}, {})
+_assert(
+    'set(declared.options) == {"!check", "!fhs", "!strip", "!tracedeps"}',
+    lambda: declared.options,
+)
+_assert("APKBUILD.options.fget(declared) is None")
+declared.options = ["check"]
+_assert('APKBUILD.options.fget(declared) == ["check"]')
+_assert(
+    'set(declared.options) == {"!fhs", "!strip", "!tracedeps"}',
+    lambda: declared.options,
+)
+with tempfile.TemporaryDirectory() as tmpdir:
+    with open(os.path.join(tmpdir, "APKBUILD"), "w") as f:
+        _ = f.write("pkgname=old\n")
+
+    broken = VELBUILD({"pkgname": "test", "pkgdesc": "${oops here"}, {})
+    _raises("broken.save(tmpdir)", bash.BashSyntaxError)
+    with open(os.path.join(tmpdir, "APKBUILD")) as f:
+        content = f.read()
+
+    _assert('content == "pkgname=old\\n"', lambda: content)
+    _assert('os.listdir(tmpdir) == ["APKBUILD"]', lambda: os.listdir(tmpdir))
+
 velbuild.pkgname = "test-pkg"
 velbuild.pkgver = "1.0"
 velbuild.pkgrel = "0"
@@ -1,24 +1,62 @@
+import fcntl
+import json
 import os
+import platform
+import re
 import shlex
 import subprocess
 import sys
+import threading
+import time
 from collections.abc import (
+    Callable,
     Generator,
     Iterator,
 )
+from contextlib import (
+    ExitStack,
+    contextmanager,
+)
 from hashlib import sha256
 from typing import (
     Any,
+    Self,
     cast,
 )
 
-from . import containers
+import docker
+import docker.errors
+import docker.models.containers
+import podman
+import podman.domain.containers
+import podman.errors
+
+from . import (
+    containers,
+    trace,
+)
+from .apkbuild import parse
+from .history import (
+    StageRecord,
+    watch_stats,
+)
+from .substeps import SubstepTimer
 
 KEY_NAME = os.environ.get("VBUILD_KEY_NAME", "vbuild")
+APK_CACHE_MAX_AGE = int(os.environ.get("VBUILD_APK_CACHE_MAX_AGE", "30"))
+BUILDER_IMAGE = "ghcr.io/eeems/vbuild-builder"
+BUILDER_TAG = os.environ.get("VBUILD_BUILDER_TAG", "main")
+DERIVED_BUILDER_IMAGE = "vbuild-builder"
+DERIVED_BUILDER_CACHE_SIZE = int(os.environ.get("VBUILD_BUILDER_CACHE_SIZE", "10"))
+# Exit code of a stage stopped because its result is no longer needed
+CANCELLED = 130
 
 SETUP_CONTAINER = [
     f"cp /root/.abuild/{KEY_NAME}.rsa.pub /etc/apk/keys/",
     'mkdir -p /dist/"$CARCH" /work/src',
+    'if [ -f /dist/"$(apk --print-arch)"/APKINDEX.tar.gz ]; then',
+    "  echo /dist >> /etc/apk/repositories",
+    "fi",
 ]
 TEARDOWN_CONTAINER_DOCKER: list[str] = [
     f"chown -R {os.getuid()}:{os.getgid()} /dist/.",
@@ -26,31 +64,287 @@ TEARDOWN_CONTAINER_DOCKER: list[str] = [
 TEARDOWN_CONTAINER_PODMAN: list[str] = []
 
 has_pulled = False
+# apk prints "(1/3) Installing name (version)" for each package it installs,
+# upgrades print "(1/3) Upgrading name (old -> version)"
+APK_INSTALLED = re.compile(
+    r"\(\d+/\d+\) (?:Installing|Upgrading|Downgrading|Replacing) (\S+) \((?:\S+ -> )?(\S+)\)"
+)
+# name-version of the packages apk installed since the cache was last evicted
+used_apks: set[str] = set()
 
 
-def abuild(
-    directory: str,
-    action: str = "all",
-    verbose: bool = False,
+def apk_cache() -> str:
+    path = os.path.join(
+        os.path.expanduser("~/.cache/vbuild/apk"),
+        platform.machine(),
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _touch_apk_cache(path: str) -> None:
+    # Cached packages are named name-version.checksum.apk, reading them doesn't
+    # reliably update st_atime so the mtime records when they were last used
+    used = set(used_apks)
+    for entry in os.scandir(path):
+        if (
+            entry.is_file()
+            and entry.name.endswith(".apk")
+            and entry.name[:-4].rpartition(".")[0] in used
+        ):
+            os.utime(entry.path)
+
+    used_apks.difference_update(used)
+
+
+def evict_apk_cache(path: str, max_age: int = APK_CACHE_MAX_AGE) -> None:
+    _touch_apk_cache(path)
+    with open(f"{path}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            # Another build is still using the cache
+            return
+
+        cutoff = time.time() - max_age * 86400
+        for entry in os.scandir(path):
+            if (
+                entry.is_file()
+                and entry.name.endswith(".apk")
+                and entry.stat().st_mtime < cutoff
+            ):
+                os.unlink(entry.path)
+
+
+def _print_logs(
+    logs: Iterator[str | bytes],
+    on_line: Callable[[str], None] | None = None,
 ) -> int:
-    directory = os.path.abspath(directory)
-    distfiles = os.path.join(
+    size = 0
+    for x in logs:
+        if isinstance(x, bytes):
+            x = x.decode()  # noqa: PLW2901
+
+        size += len(x)
+        for line in x.splitlines():
+            if (match := APK_INSTALLED.search(line)) is not None:
+                used_apks.add(f"{match[1]}-{match[2]}")
+
+            if on_line is not None:
+                on_line(line)
+
+        x = x.strip()  # noqa: PLW2901
+        if x:
+            print(x, file=sys.stderr)
+
+    return size
+
+
+def derived_builder_tag(base_id: str, makedepends: list[str], carch: str) -> str:
+    key = sha256("\n".join([*sorted(set(makedepends)), carch]).encode()).hexdigest()
+    return f"{base_id.rsplit(':', maxsplit=1)[-1][:12]}-{key[:12]}"
+
+
+@contextmanager
+def _builders() -> Iterator[tuple[dict[str, float], list[str]]]:
+    # When each derived builder was last used, and the ones that couldn't be
+    # created
+    path = os.path.expanduser("~/.cache/vbuild/builders.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        _ = f.seek(0)
+        data = f.read()
+        state = cast(dict[str, Any], json.loads(data) if data else {})  # pyright: ignore[reportExplicitAny]
+        if "used" not in state:
+            # Written before failures were recorded
+            state = {"used": state, "failed": []}
+
+        last_used = cast(dict[str, float], state["used"])
+        failed = cast(list[str], state["failed"])
+        yield last_used, failed
+        _ = f.seek(0)
+        _ = f.truncate()
+        json.dump({"used": last_used, "failed": failed}, f)
+
+
+def _failed_derived_builder(tag: str) -> bool:
+    with _builders() as (_, failed):
+        return tag in failed
+
+
+def _fail_derived_builder(tag: str) -> None:
+    base_id = tag.split("-", maxsplit=1)[0]
+    with _builders() as (_, failed):
+        # Builders from an older base image will never be tried again
+        failed[:] = [x for x in failed if x.split("-", maxsplit=1)[0] == base_id]
+        if tag not in failed:
+            failed.append(tag)
+
+
+def _touch_derived_builder(
+    client: podman.PodmanClient | docker.DockerClient,
+    tag: str,
+) -> None:
+    with _builders() as (last_used, _):
+        last_used[tag] = time.time()
+        expired = sorted(last_used, key=lambda x: last_used[x], reverse=True)[
+            DERIVED_BUILDER_CACHE_SIZE:
+        ]
+        for name in expired:
+            try:
+                with trace.span("image.remove", "daemon", image=name):
+                    client.images.remove(f"{DERIVED_BUILDER_IMAGE}:{name}")  # pyright: ignore[reportUnknownMemberType]
+
+            except (docker.errors.ImageNotFound, podman.errors.ImageNotFound):
+                pass
+
+            except Exception as e:
+                # Most likely still in use by another build, try again next time
+                print(f"Unable to remove builder {name}: {e}", file=sys.stderr)
+                continue
+
+            del last_used[name]
+
+
+def derived_builder(
+    client: podman.PodmanClient | docker.DockerClient,
+    makedepends: list[str],
+    apkcache: str,
+    record: StageRecord | None = None,
+) -> str:
+    base = f"{BUILDER_IMAGE}:{BUILDER_TAG}"
+    makedepends = [x for x in makedepends if not x.startswith("!")]
+    if not makedepends:
+        return base
+
+    carch = os.environ.get("CARCH", "noarch")
+    with trace.span("image.get", "daemon", image=base):
+        base_id = cast(str, client.images.get(base).id)  # pyright: ignore[reportUnknownMemberType]
+
+    tag = derived_builder_tag(base_id, makedepends, carch)
+    image = f"{DERIVED_BUILDER_IMAGE}:{tag}"
+    if _failed_derived_builder(tag):
+        # The tag changes with the base image and makedepends, either one
+        # changing gives it another try
+        if record is not None:
+            record.cache["builder"] = False
+
+        return base
+
+    try:
+        with trace.span("image.get", "daemon", image=image):
+            _ = client.images.get(image)  # pyright: ignore[reportUnknownMemberType]
+
+        if record is not None:
+            record.cache["builder"] = True
+
+    except (docker.errors.ImageNotFound, podman.errors.ImageNotFound):
+        if record is not None:
+            record.cache["builder"] = False
+
+        print(f"Creating builder {image}", file=sys.stderr)
+        with trace.span("container.run", "daemon", image=base):
+            container = client.containers.run(  # pyright: ignore[reportUnknownMemberType]
+                base,
+                [
+                    "sh",
+                    "-ec",
+                    "apk add --virtual .vbuild-makedepends "
+                    + shlex.join(sorted(set(makedepends))),
+                ],
+                detach=True,
+                volumes={apkcache: {"bind": "/etc/apk/cache", "mode": "rw"}},
+                environment={"CARCH": carch},
+            )
+
+        assert not isinstance(container, Generator)
+        assert not isinstance(container, Iterator)
+        try:
+            _ = _print_logs(
+                cast(Iterator[bytes], container.logs(stream=True))  # pyright: ignore[reportUnknownMemberType]
+            )
+            with trace.span("container.wait", "daemon"):
+                ret = container.wait()  # pyright: ignore[reportUnknownMemberType]
+
+            if isinstance(ret, dict):
+                ret = ret.get("StatusCode")  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+
+            if ret:
+                # Some makedepends are most likely only available from
+                # REPODEST, let abuild install them into the base image
+                print(
+                    f"Unable to create builder {image}, using {base}",
+                    file=sys.stderr,
+                )
+                _fail_derived_builder(tag)
+                return base
+
+            with trace.span("container.commit", "daemon", image=image):
+                _ = container.commit(repository=DERIVED_BUILDER_IMAGE, tag=tag)  # pyright: ignore[reportUnknownMemberType]
+
+        finally:
+            with trace.span("container.remove", "daemon"):
+                container.remove()  # pyright: ignore[reportUnknownMemberType]
+
+    _touch_derived_builder(client, tag)
+    return image
+
+
+def distfiles_dir(directory: str) -> str:
+    return os.path.join(
         os.path.expanduser("~/.cache/vbuild/distfiles"),
-        sha256(directory.encode()).hexdigest(),
+        sha256(os.path.abspath(directory).encode()).hexdigest(),
     )
-    os.makedirs(distfiles, exist_ok=True)
-    filepath = os.path.join(directory, "APKBUILD")
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(filepath)
 
+
+def _stop_on_cancel(
+    container: podman.domain.containers.Container | docker.models.containers.Container,
+    cancel: threading.Event,
+) -> threading.Event:
+    done = threading.Event()
+
+    def run() -> None:
+        while not done.is_set():
+            if not cancel.wait(0.1):
+                continue
+
+            with trace.span("container.stop", "daemon"):
+                try:
+                    container.stop()  # pyright: ignore[reportUnknownMemberType]
+
+                except Exception:  # noqa: S110
+                    # The container already exited
+                    pass
+
+            return
+
+    threading.Thread(target=run, daemon=True).start()
+    return done
+
+
+def _abuilddir() -> str:
     abuilddir = os.path.expanduser("~/.config/vbuild")
     key_path = os.path.join(abuilddir, f"{KEY_NAME}.rsa")
     os.makedirs(abuilddir, exist_ok=True)
     if not os.path.exists(key_path):
-        _ = subprocess.check_call(["openssl", "genrsa", "-out", key_path])
-        _ = subprocess.check_call(
-            ["openssl", "rsa", "-in", key_path, "-pubout", "-out", f"{key_path}.pub"]
-        )
+        with trace.span("openssl genrsa", "subprocess"):
+            _ = subprocess.check_call(["openssl", "genrsa", "-out", key_path])
+
+        with trace.span("openssl rsa", "subprocess"):
+            _ = subprocess.check_call(
+                [
+                    "openssl",
+                    "rsa",
+                    "-in",
+                    key_path,
+                    "-pubout",
+                    "-out",
+                    f"{key_path}.pub",
+                ]
+            )
+
         os.chmod(key_path, 0o600)
 
     conf_path = os.path.join(abuilddir, "abuild.conf")
@@ -65,98 +359,201 @@ def abuild(
         _ = f.truncate()
         f.writelines(lines)
 
-    with containers.from_env() as client:
-        runtime = containers.runtime()
-        assert runtime is not None
-        print(f"Container driver: {runtime}", file=sys.stderr)
+    return abuilddir
 
-        global has_pulled
-        if not has_pulled:
-            logs = containers.pull(client, "ghcr.io/eeems/vbuild-builder", "main")
-            for x in logs:
-                if isinstance(x, bytes):
-                    x = x.decode()  # noqa: PLW2901
 
-                x = x.strip()  # noqa: PLW2901
-                if x:
-                    print(x, file=sys.stderr)
+def abuild(
+    directory: str,
+    action: str = "all",
+    *,
+    verbose: bool = False,
+    makedepends: list[str] | None = None,
+    client: podman.PodmanClient | docker.DockerClient | None = None,
+    timer: SubstepTimer | None = None,
+    record: StageRecord | None = None,
+    cancel: threading.Event | None = None,
+) -> int:
+    directory = os.path.abspath(directory)
+    distfiles = distfiles_dir(directory)
+    os.makedirs(distfiles, exist_ok=True)
+    filepath = os.path.join(directory, "APKBUILD")
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
 
-            has_pulled = True
+    if makedepends is None:
+        makedepends = parse(filepath).makedepends or []
 
-        distdir = os.path.realpath(
-            os.environ.get("REPODEST", None) or os.path.join(directory, "dist")
+    abuilddir = _abuilddir()
+    apkcache = apk_cache()
+    with open(f"{apkcache}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        ret = _run(
+            directory=directory,
+            action=action,
+            verbose=verbose,
+            distfiles=distfiles,
+            abuilddir=abuilddir,
+            apkcache=apkcache,
+            makedepends=makedepends,
+            client=client,
+            timer=timer,
+            record=record,
+            cancel=cancel,
         )
-        os.makedirs(distdir, exist_ok=True)
-        os.makedirs(os.path.join(directory, "src"), exist_ok=True)
-        run_kwargs: dict[str, Any] = {  # pyright: ignore[reportExplicitAny]
-            "detach": True,
-            "volumes": {
-                distdir: {"bind": "/dist", "mode": "rw"},
-                distfiles: {"bind": "/var/cache/distfiles", "mode": "rw"},
-                abuilddir: {"bind": "/root/.abuild", "mode": "ro"},
-            },
-            "environment": {
-                "CARCH": os.environ.get("CARCH", "noarch"),
-                "SOURCE_DATE_EPOCH": os.environ.get("SOURCE_DATE_EPOCH", "0"),
-                "REPODEST": "/dist",
-                "VBUILD_WORKDIR": directory,
-                "VBUILD_DISTFILES": distfiles,
-            },
-        }
-        teardown = []
-        match runtime:
-            case "podman":
-                run_kwargs["volumes"][directory] = {"bind": "/work", "mode": "Z"}
-                socket_uri = cast(str, client.info()["host"]["remoteSocket"]["path"])  # pyright: ignore[reportUnknownMemberType]
-                socket = (
-                    socket_uri.split("://", 1)[1] if "://" in socket_uri else socket_uri
-                )
-                run_kwargs["volumes"][socket] = {
-                    "bind": "/run/podman/podman.sock",
-                    "mode": "rw",
-                }
-                teardown = TEARDOWN_CONTAINER_PODMAN
-
-            case "docker":
-                run_kwargs["volumes"][directory] = {"bind": "/work", "mode": "Z"}
-                run_kwargs["volumes"]["/var/run/docker.sock"] = {
-                    "bind": "/var/run/docker.sock",
-                    "mode": "rw",
-                }
-                teardown = TEARDOWN_CONTAINER_DOCKER
-
-        container = client.containers.run(  # pyright: ignore[reportUnknownMemberType]
-            f"ghcr.io/eeems/vbuild-builder:{os.environ.get('VBUILD_BUILDER_TAG', 'main')}",
-            [
-                "sh",
-                "-ec",
-                "\n".join(
-                    [
-                        *SETUP_CONTAINER,
-                        f"abuild -C /work -d -F -r {'-v' if verbose else ''} {shlex.quote(action)}",
-                        *teardown,
-                    ]
-                ),
-            ],
-            **run_kwargs,  # pyright: ignore[reportAny]
+
+    evict_apk_cache(apkcache)
+    return ret
+
+
+def _pull_builder(client: podman.PodmanClient | docker.DockerClient) -> None:
+    global has_pulled
+    if has_pulled:
+        return
+
+    with trace.span("pull", "daemon", image=BUILDER_IMAGE, tag=BUILDER_TAG) as span:
+        layers: dict[str, int] = {}
+        _ = _print_logs(containers.pull(client, BUILDER_IMAGE, BUILDER_TAG, layers))
+        span.set(bytes=sum(layers.values()))
+
+    has_pulled = True
+
+
+def _abuild_command(action: str, verbose: bool) -> str:
+    return f"abuild -C /work -d -F -r {'-v' if verbose else ''} {shlex.quote(action)}"
+
+
+def _container_kwargs(
+    client: podman.PodmanClient | docker.DockerClient,
+    runtime: str,
+    *,
+    directory: str,
+    distfiles: str,
+    abuilddir: str,
+    apkcache: str,
+) -> tuple[dict[str, Any], list[str]]:  # pyright: ignore[reportExplicitAny]
+    distdir = os.path.realpath(
+        os.environ.get("REPODEST", None) or os.path.join(directory, "dist")
+    )
+    os.makedirs(distdir, exist_ok=True)
+    os.makedirs(os.path.join(directory, "src"), exist_ok=True)
+    run_kwargs: dict[str, Any] = {  # pyright: ignore[reportExplicitAny]
+        "volumes": {
+            distdir: {"bind": "/dist", "mode": "rw"},
+            distfiles: {"bind": "/var/cache/distfiles", "mode": "rw"},
+            abuilddir: {"bind": "/root/.abuild", "mode": "ro"},
+            apkcache: {"bind": "/etc/apk/cache", "mode": "rw"},
+        },
+        "environment": {
+            "CARCH": os.environ.get("CARCH", "noarch"),
+            "SOURCE_DATE_EPOCH": os.environ.get("SOURCE_DATE_EPOCH", "0"),
+            "REPODEST": "/dist",
+            "VBUILD_WORKDIR": directory,
+            "VBUILD_DISTFILES": distfiles,
+        },
+    }
+    teardown = []
+    match runtime:
+        case "podman":
+            run_kwargs["volumes"][directory] = {"bind": "/work", "mode": "Z"}
+            socket_uri = cast(str, client.info()["host"]["remoteSocket"]["path"])  # pyright: ignore[reportUnknownMemberType]
+            socket = (
+                socket_uri.split("://", 1)[1] if "://" in socket_uri else socket_uri
+            )
+            run_kwargs["volumes"][socket] = {
+                "bind": "/run/podman/podman.sock",
+                "mode": "rw",
+            }
+            teardown = TEARDOWN_CONTAINER_PODMAN
+
+        case "docker":
+            run_kwargs["volumes"][directory] = {"bind": "/work", "mode": "Z"}
+            run_kwargs["volumes"]["/var/run/docker.sock"] = {
+                "bind": "/var/run/docker.sock",
+                "mode": "rw",
+            }
+            teardown = TEARDOWN_CONTAINER_DOCKER
+
+    return run_kwargs, teardown
+
+
+def _run(
+    *,
+    directory: str,
+    action: str,
+    verbose: bool,
+    distfiles: str,
+    abuilddir: str,
+    apkcache: str,
+    makedepends: list[str],
+    client: podman.PodmanClient | docker.DockerClient | None,
+    timer: SubstepTimer | None,
+    record: StageRecord | None,
+    cancel: threading.Event | None,
+) -> int:
+    with ExitStack() as stack:
+        if client is None:
+            client = stack.enter_context(containers.from_env())
+
+        runtime = containers.runtime(client)
+        assert runtime is not None
+        print(f"Container driver: {runtime}", file=sys.stderr)
+
+        _pull_builder(client)
+        image = derived_builder(client, makedepends, apkcache, record)
+        if cancel is not None and cancel.is_set():
+            return CANCELLED
+
+        run_kwargs, teardown = _container_kwargs(
+            client,
+            runtime,
+            directory=directory,
+            distfiles=distfiles,
+            abuilddir=abuilddir,
+            apkcache=apkcache,
         )
-        assert not isinstance(container, Generator)
-        assert not isinstance(container, Iterator)
+        with trace.span("container.create", "daemon", image=image, stage=action):
+            container = containers.create(
+                client,
+                image,
+                [
+                    "sh",
+                    "-ec",
+                    "\n".join(
+                        [*SETUP_CONTAINER, _abuild_command(action, verbose), *teardown]
+                    ),
+                ],
+                **run_kwargs,  # pyright: ignore[reportAny]
+            )
+
         try:
-            logs = container.logs(stream=True)  # pyright: ignore[reportUnknownMemberType]
-            for x in logs:
-                if isinstance(x, bytes):
-                    x = x.decode()  # noqa: PLW2901
+            with trace.span("container.start", "daemon", stage=action):
+                container.start()  # pyright: ignore[reportUnknownMemberType]
+
+            if cancel is not None:
+                stack.callback(_stop_on_cancel(container, cancel).set)
 
-                assert isinstance(x, str)
-                x = x.strip()  # noqa: PLW2901
-                if x:
-                    print(x, file=sys.stderr)
+            stats = None
+            if record is not None:
+                record.builder = cast(str | None, container.attrs.get("Image"))  # pyright: ignore[reportUnknownMemberType]
+                stats = watch_stats(container, record)
+
+            with trace.span("container.logs", "container", stage=action) as span:
+                span.set(
+                    bytes=_print_logs(
+                        cast(Iterator[bytes], container.logs(stream=True)),  # pyright: ignore[reportUnknownMemberType]
+                        None if timer is None else timer.feed,
+                    )
+                )
+
+            with trace.span("container.wait", "daemon", stage=action):
+                ret = container.wait()  # pyright: ignore[reportUnknownMemberType]
 
-            ret = container.wait()  # pyright: ignore[reportUnknownMemberType]
             if isinstance(ret, dict):
                 ret = ret.get("StatusCode")  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
 
+            if stats is not None:
+                stats.join(timeout=1)
+
             assert isinstance(ret, int)
             return ret
 
@@ -168,4 +565,130 @@ def abuild(
                 except Exception:  # noqa: S110
                     pass
 
-            container.remove()  # pyright: ignore[reportUnknownMemberType]
+            with trace.span("container.remove", "daemon", stage=action):
+                container.remove()  # pyright: ignore[reportUnknownMemberType]
+
+
+class Session:
+    # Keeps one builder container running and runs each stage in it with exec,
+    # instead of starting a new container for every stage
+    def __init__(
+        self,
+        directory: str,
+        client: podman.PodmanClient | docker.DockerClient,
+        *,
+        verbose: bool = False,
+    ) -> None:
+        self.directory: str = os.path.abspath(directory)
+        self.client: podman.PodmanClient | docker.DockerClient = client
+        self.verbose: bool = verbose
+        self._stack: ExitStack = ExitStack()
+        self._container: (
+            podman.domain.containers.Container
+            | docker.models.containers.Container
+            | None
+        ) = None
+        self._makedepends: list[str] = []
+        self._teardown: list[str] = []
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _start(self, makedepends: list[str], record: StageRecord | None) -> None:
+        distfiles = distfiles_dir(self.directory)
+        os.makedirs(distfiles, exist_ok=True)
+        abuilddir = _abuilddir()
+        apkcache = apk_cache()
+        lock = self._stack.enter_context(open(f"{apkcache}.lock", "a"))  # noqa: SIM115
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        runtime = containers.runtime(self.client)
+        assert runtime is not None
+        _pull_builder(self.client)
+        image = derived_builder(self.client, makedepends, apkcache, record)
+        run_kwargs, self._teardown = _container_kwargs(
+            self.client,
+            runtime,
+            directory=self.directory,
+            distfiles=distfiles,
+            abuilddir=abuilddir,
+            apkcache=apkcache,
+        )
+        os.makedirs(os.path.join(self.directory, "src"), exist_ok=True)
+        with trace.span("container.create", "daemon", image=image, stage="session"):
+            container = containers.create(
+                self.client,
+                image,
+                ["sh", "-ec", "\n".join([*SETUP_CONTAINER, "exec tail -f /dev/null"])],
+                **run_kwargs,  # pyright: ignore[reportAny]
+            )
+
+        self._stack.callback(_remove, container)
+        with trace.span("container.start", "daemon", stage="session"):
+            container.start()  # pyright: ignore[reportUnknownMemberType]
+
+        self._container = container
+        self._makedepends = sorted(set(makedepends))
+
+    def run(
+        self,
+        action: str,
+        makedepends: list[str],
+        timer: SubstepTimer | None = None,
+        record: StageRecord | None = None,
+    ) -> int:
+        if self._container is None or self._makedepends != sorted(set(makedepends)):
+            self.close()
+            self._start(makedepends, record)
+
+        assert self._container is not None
+        if record is not None:
+            record.builder = cast(str | None, self._container.attrs.get("Image"))  # pyright: ignore[reportUnknownMemberType]
+
+        os.makedirs(os.path.join(self.directory, "src"), exist_ok=True)
+        with trace.span("container.exec", "daemon", stage=action):
+            exec_id, output = containers.exec_start(
+                self.client,
+                self._container,
+                [
+                    "sh",
+                    "-ec",
+                    "\n".join([_abuild_command(action, self.verbose), *self._teardown]),
+                ],
+            )
+
+        with trace.span("container.logs", "container", stage=action) as span:
+            span.set(bytes=_print_logs(output, None if timer is None else timer.feed))
+
+        with trace.span("container.wait", "daemon", stage=action):
+            # The output can end just before the engine notices the exec exited
+            while (state := containers.exec_inspect(self.client, exec_id)).get(
+                "Running"
+            ):
+                time.sleep(0.1)
+
+        ret = state.get("ExitCode")  # pyright: ignore[reportAny]
+        assert isinstance(ret, int)
+        return ret
+
+    def close(self) -> None:
+        started = self._container is not None
+        self._stack.close()
+        self._container = None
+        if started:
+            evict_apk_cache(apk_cache())
+
+
+def _remove(
+    container: podman.domain.containers.Container | docker.models.containers.Container,
+) -> None:
+    try:
+        container.stop()  # pyright: ignore[reportUnknownMemberType]
+
+    except Exception:  # noqa: S110
+        pass
+
+    with trace.span("container.remove", "daemon", stage="session"):
+        container.remove()  # pyright: ignore[reportUnknownMemberType]
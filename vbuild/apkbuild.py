@@ -1,14 +1,20 @@
 import inspect
-import shlex
-import string
+import itertools
+import os
+import re
 import types
 from collections.abc import (
     Callable,
     Generator,
+    Iterable,
 )
 from enum import Enum
+from io import StringIO
 from typing import (
     Any,
+    Self,
+    TextIO,
+    cast,
     get_type_hints,
     override,
 )
@@ -77,6 +83,10 @@ class ErrorType(Enum):
 
 
 class Property[T](property):
+    # Validates and caches the variable when an APKBUILD is created, set by
+    # the decorator that made the property
+    load: "Callable[[APKBUILD], None] | None" = None
+
     @override
     def __get__(self, obj: Any, objtype: type | None = None) -> T:  # pyright: ignore[reportExplicitAny, reportAny, reportIncompatibleMethodOverride]
         return super().__get__(obj, objtype)  # pyright: ignore[reportAny]
@@ -99,6 +109,102 @@ def is_type(value: Any, annotation: Any) -> bool:  # pyright: ignore[reportExpli
     return isinstance(value, annotation)
 
 
+# A line of output, split into parts so large function bodies aren't copied
+Line = str | tuple[str, ...]
+
+# Shared between every VersionedDict so a version is never reused
+_versions = itertools.count(1)
+
+
+class VersionedDict[V](dict[str, V]):
+    __slots__: tuple[str, ...] = ("version",)
+
+    def __init__(self, *args: Any, **kwargs: V) -> None:  # pyright: ignore[reportExplicitAny]
+        super().__init__(*args, **kwargs)  # pyright: ignore[reportAny]
+        self.version: int = next(_versions)
+
+    def _changed(self) -> None:
+        self.version = next(_versions)
+
+    @override
+    def __setitem__(self, key: str, value: V) -> None:
+        super().__setitem__(key, value)
+        self._changed()
+
+    @override
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._changed()
+
+    @override
+    def __ior__(self, other: Any) -> Self:  # pyright: ignore[reportExplicitAny, reportIncompatibleMethodOverride]
+        _ = super().__ior__(other)  # pyright: ignore[reportAny]
+        self._changed()
+        return self
+
+    @override
+    def clear(self) -> None:
+        super().clear()
+        self._changed()
+
+    @override
+    def pop(self, *args: Any) -> V:  # pyright: ignore[reportExplicitAny, reportIncompatibleMethodOverride]
+        value = super().pop(*args)  # pyright: ignore[reportAny]
+        self._changed()
+        return cast(V, value)
+
+    @override
+    def popitem(self) -> tuple[str, V]:
+        item = super().popitem()
+        self._changed()
+        return item
+
+    @override
+    def setdefault(self, key: str, default: V = None) -> V:  # pyright: ignore[reportIncompatibleMethodOverride, reportArgumentType]
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    @override
+    def update(self, *args: Any, **kwargs: V) -> None:  # pyright: ignore[reportExplicitAny, reportIncompatibleMethodOverride]
+        super().update(*args, **kwargs)  # pyright: ignore[reportAny]
+        self._changed()
+
+
+def cached_value[T](
+    self: "APKBUILD",
+    key: Callable[..., object],
+    name: str,
+    annotation: Any,  # pyright: ignore[reportExplicitAny, reportAny]
+    func: Callable[[Any], T],  # pyright: ignore[reportExplicitAny]
+) -> T:
+    # Keyed by the property's getter, a subclass can override a property with
+    # one that computes something else from the same variable
+    value = self.variables.get(name, None)
+    cached = self._values.get(key, None)
+    if cached is not None and cached[0] is value:
+        result = cast(T, cached[1])
+
+    else:
+        assert is_type(value, annotation), f"Cannot get {name}, value is not valid"
+        result = func(value)
+        self._values[key] = (value, result)
+
+    # Don't let callers modify the cached list
+    return cast(T, list(result)) if isinstance(result, list) else result
+
+
+def store_value(
+    self: "APKBUILD",
+    key: Callable[..., object],
+    name: str,
+    value: bash.VariableValue,
+    result: object,
+) -> None:
+    self.variables[name] = value
+    self._values[key] = (value, result)
+
+
 def typed_property[T](func: Callable[..., T]) -> Property[T]:
     name = func.__name__
     parameters = [p for p in inspect.signature(func).parameters if p != "self"]
@@ -108,20 +214,23 @@ def typed_property[T](func: Callable[..., T]) -> Property[T]:
     )
 
     def fget(self: "APKBUILD") -> T:
-        value = self.variables.get(name, None)
-        assert is_type(value, annotation), f"Cannot get {name}, value is not valid"
-        return func(self, value)
+        return cached_value(self, fget, name, annotation, lambda x: func(self, x))
 
     def fset(self: "APKBUILD", value: T) -> None:
         assert is_type(value, annotation), (
             f"Cannot set {name}, value is not {annotation}"
         )
-        self.variables[name] = value  # pyright: ignore[reportArgumentType]
+        store_value(self, fget, name, value, func(self, value))  # pyright: ignore[reportArgumentType]
 
     def fdel(self: "APKBUILD") -> None:
         del self.variables[name]
 
-    return Property(fget, fset, fdel, func.__doc__)
+    def load(self: "APKBUILD") -> None:
+        _ = fget(self)
+
+    prop = Property[T](fget, fset, fdel, func.__doc__)
+    prop.load = load
+    return prop
 
 
 def string_array_property(
@@ -130,92 +239,106 @@ def string_array_property(
     name = func.__name__
 
     def fget(self: "APKBUILD") -> list[str] | None:
-        value = self.variables.get(name, None)
-        assert is_type(value, str | None), f"Cannot get {name}, value is not valid"
-        if value is None:
-            return func(self, None)
+        return cached_value(
+            self,
+            fget,
+            name,
+            str | None,
+            lambda x: func(self, None if x is None else cast(str, x).split()),
+        )
 
-        assert isinstance(value, str)
-        return func(self, value.split())
+    def store(self: "APKBUILD", value: list[str] | None) -> None:
+        store_value(
+            self,
+            fget,
+            name,
+            None if value is None else f"\n{'\n'.join(value)}\n",
+            func(self, None if value is None else list(value)),
+        )
 
     def fset(self: "APKBUILD", value: list[str] | None) -> None:
         assert is_type(value, list[str] | None), (
             f"Cannot set {name}, value is not valid"
         )
-        self.variables[name] = None if value is None else f"\n{'\n'.join(value)}\n"
+        store(self, value)
 
     def fdel(self: "APKBUILD") -> None:
         del self.variables[name]
 
-    return Property[list[str] | None](fget, fset, fdel, func.__doc__)
-
+    def load(self: "APKBUILD") -> None:
+        # Stored in the same newline separated form the setter uses
+        value = self.variables.get(name, None)
+        assert is_type(value, str | None), f"Cannot get {name}, value is not valid"
+        store(self, None if value is None else cast(str, value).split())
 
-def get_token(value: str, offset: int) -> tuple[int, str]:
-    size = len(value)
-    if offset >= size:
-        return (offset, "")
+    prop = Property[list[str] | None](fget, fset, fdel, func.__doc__)
+    prop.load = load
+    return prop
 
-    token = value[offset]
-    token_chars = string.ascii_letters + string.digits + "-_"
-    if token not in token_chars:
-        offset += 1
-        return offset, token
 
-    while True:
-        offset += 1
-        if offset >= size:
-            break
+TOKEN = re.compile(r"[A-Za-z0-9_-]+")
+# Same format apk version --check accepts
+VERSION = re.compile(
+    r"[0-9]+(\.[0-9]+)*[a-z]?(_(alpha|beta|pre|rc|cvs|svn|git|hg|p)[0-9]*)*"
+    + r"(~[0-9a-f]+)?(-r[0-9]+)?"
+)
+ARCH = re.compile(r"!?[a-z0-9_]+")
+# [!]name[@tag][op version], where name can also be a path or a so:, cmd: or
+# pc: provider
+DEPENDENCY = re.compile(
+    r"!?[A-Za-z0-9_/][A-Za-z0-9_.+:/@-]*"
+    + rf"((<|<=|=|>=|>|~|~=|><){VERSION.pattern})?"
+)
+INSTALL_SUFFIXES = (
+    "pre-install",
+    "post-install",
+    "pre-upgrade",
+    "post-upgrade",
+    "pre-deinstall",
+    "post-deinstall",
+)
 
-        next_char = value[offset]
 
-        if next_char not in token_chars:
-            break
+def get_token(value: str, offset: int) -> tuple[int, str]:
+    if offset >= len(value):
+        return (offset, "")
 
-        token += next_char
+    match = TOKEN.match(value, offset)
+    if match is None:
+        return offset + 1, value[offset]
 
-    return offset, token
+    return match.end(), match.group()
 
 
 def quoted_string(value: str) -> str:
-    offset = 0
-    quoted_value = ""
+    parts: list[str] = []
     in_quote = False
+    offset = 0
     size = len(value)
-    while True:
-        if offset >= size:
-            if in_quote:
-                quoted_value += "'"
-
+    while offset < size:
+        index = value.find("$", offset)
+        end = size if index == -1 else index
+        if end > offset:
+            for i, run in enumerate(value[offset:end].split("'")):
+                if i:
+                    parts.append("'\"'\"'" if in_quote else '"\'"')
+
+                if run:
+                    if not in_quote:
+                        in_quote = True
+                        parts.append("'")
+
+                    parts.append(run)
+
+        if index == -1:
             break
 
-        token = value[offset]
-        offset += 1
-
-        if token != "$":  # noqa: S105
-            if token != "'":  # noqa: S105
-                if not in_quote:
-                    in_quote = True
-                    quoted_value += "'"
-
-                quoted_value += token
-                continue
-
-            if in_quote:
-                quoted_value += "'"
-
-            quoted_value += '"\'"'
-            if in_quote:
-                quoted_value += "'"
-
-            continue
-
-        offset, name = get_token(value, offset)
+        offset, name = get_token(value, index + 1)
         source = "$" + name
         if name == "{":
             offset, name = get_token(value, offset)
-            source += name
             offset, next_token = get_token(value, offset)
-            source += next_token
+            source += name + next_token
             if next_token != "}" and offset < size:  # noqa: S105
                 raise bash.BashSyntaxError(
                     f"Unexpected token: '{next_token}'. Expecting '}}'", value, 1
@@ -224,18 +347,25 @@ def quoted_string(value: str) -> str:
         if name not in APKBUILD_AUTOMATIC_VARIABLES:
             if not in_quote:
                 in_quote = True
-                quoted_value += "'"
+                parts.append("'")
 
-            quoted_value += shlex.quote(source)[1:-1]
+            parts.append(source.replace("'", "'\"'\"'"))
             continue
 
         if in_quote:
             in_quote = False
-            quoted_value += "'"
+            parts.append("'")
+
+        parts.append(f"${name}")
 
-        quoted_value += f"${name}"
+    if in_quote:
+        parts.append("'")
 
-    return quoted_value
+    return "".join(parts)
+
+
+def quoted_strings(values: Iterable[str | None]) -> list[str]:
+    return [quoted_string(x) for x in values if x is not None]
 
 
 def put_variables(variables: bash.Variables) -> str:
@@ -252,9 +382,11 @@ def put_variables(variables: bash.Variables) -> str:
 
         elif isinstance(value, list):
             lines.append(f"{name}=(")
-            for index, x in enumerate(value):
-                if x is not None:
-                    lines.append(f"  [{index}]={quoted_string(x)}")
+            indexes = [i for i, x in enumerate(value) if x is not None]
+            lines.extend(
+                f"  [{i}]={x}"
+                for i, x in zip(indexes, quoted_strings(value), strict=True)
+            )
 
             lines.append(")")
 
@@ -273,20 +405,71 @@ def put_variables(variables: bash.Variables) -> str:
 
 class APKBUILD:
     def __init__(self, variables: bash.Variables, functions: bash.Functions) -> None:
-        self.variables: bash.Variables = variables
-        self.functions: bash.Functions = functions
+        self.variables: bash.Variables = VersionedDict(variables)
+        self.functions: bash.Functions = VersionedDict(functions)
+        # Property values computed from the variable they were last read from
+        self._values: dict[
+            Callable[..., object], tuple[bash.VariableValue, object]
+        ] = {}
+        # Values computed from every variable and function, and their versions
+        self._memos: dict[str, tuple[tuple[int, int], object]] = {}
         for name in variables:
             prop = getattr(APKBUILD, name, None)
-            if not isinstance(prop, property) or prop.fset is None or prop.fget is None:
-                continue
+            if isinstance(prop, Property) and prop.load is not None:
+                prop.load(self)
+
+    @classmethod
+    def from_views(
+        cls,
+        variables: bash.Variables,
+        functions: bash.Functions,
+        views: dict[str, object],
+    ) -> Self:
+        # Views computed earlier, for example by a saved model, are used until
+        # the package changes instead of being computed again
+        apkbuild = cls(variables, functions)
+        for name, value in views.items():
+            _ = apkbuild._memo(name, lambda value=value: value)
+
+        return apkbuild
+
+    def _memo[T](self, name: str, func: Callable[[], T]) -> T:
+        variables_version = getattr(self.variables, "version", None)
+        functions_version = getattr(self.functions, "version", None)
+        if variables_version is None or functions_version is None:
+            return func()
+
+        key = (cast(int, variables_version), cast(int, functions_version))
+        cached = self._memos.get(name, None)
+        if cached is not None and cached[0] == key:
+            return cast(T, cached[1])
+
+        value = func()
+        self._memos[name] = (key, value)
+        return value
+
+    def chunks(self) -> Generator[str]:
+        for index, line in enumerate(self._lines()):
+            if index:
+                yield "\n"
+
+            if isinstance(line, str):
+                yield line
 
-            if isinstance(prop, Property):
-                prop.fset(self, prop.fget(self))
+            else:
+                yield from line
+
+    def render(self, fp: TextIO) -> None:
+        for chunk in self.chunks():
+            _ = fp.write(chunk)
 
     @property
     def text(self) -> str:
-        lines: list[str] = []
+        buffer = StringIO()
+        self.render(buffer)
+        return buffer.getvalue()
 
+    def _lines(self) -> Generator[Line]:
         for name, value in self.variables.items():
             if value is None or name in bash.DEFAULT_VARIABLE_NAMES:
                 continue
@@ -298,32 +481,27 @@ class APKBUILD:
                 continue
 
             if isinstance(value, str):
-                lines.append(f"{name}={quoted_string(value)}")
+                yield f"{name}={quoted_string(value)}"
 
             elif isinstance(value, list):
-                lines.append(f"{name}=(")
-                for x in value:
-                    if x is not None:
-                        lines.append(f"  {quoted_string(x)}")
-
-                lines.append(")")
+                yield f"{name}=("
+                yield from (f"  {x}" for x in quoted_strings(value))
+                yield ")"
 
             elif isinstance(value, dict):  # pyright: ignore[reportUnnecessaryIsInstance]
-                lines.append(f"{name}=(")
+                yield f"{name}=("
                 for k, v in value.items():
-                    lines.append(f"  [{k}]={quoted_string(v)}")
+                    yield f"  [{k}]={quoted_string(v)}"
 
-                lines.append(")")
+                yield ")"
 
         subpackage_functions = self._subpackages.values()
         for name, value in self.functions.items():
             if name not in subpackage_functions:
-                lines.append(f"{name}() {{{value}}}")
+                yield (f"{name}() {{", value, "}")
 
         for name, value in self.subpackages.items():
-            lines.append(f"{name}() {{{value}}}")
-
-        return "\n".join(lines)
+            yield (f"{name}() {{", value, "}")
 
     def validate(self) -> Generator[tuple[ErrorType, str]]:
         if self._upstream_author is None:
@@ -348,6 +526,194 @@ class APKBUILD:
                 "_status is not valid, must be 'maintained', 'unmaintained', or 'deprecated'",
             )
 
+    def _words(self, name: str) -> list[str]:
+        value = self.variables.get(name, None)
+        return value.split() if isinstance(value, str) else []
+
+    def sanitycheck(
+        self, directory: str | None = None
+    ) -> Generator[tuple[ErrorType, str]]:
+        # Same rules and messages as abuild's sanitycheck, which stops at the
+        # first error. Files are only checked when the directory is known.
+        pkgname = " ".join(self._words("pkgname"))
+        pkgver = " ".join(self._words("pkgver"))
+        version = f"{pkgver}-r{' '.join(self._words('pkgrel')) or 0}"
+        if not pkgname:
+            yield ErrorType.Error, "Missing pkgname in APKBUILD"
+
+        elif pkgname != self.variables["pkgname"]:
+            yield ErrorType.Error, "pkgname contains spaces"
+
+        if not pkgver:
+            yield ErrorType.Error, "Missing pkgver in APKBUILD"
+
+        elif pkgver != "volatile" and not VERSION.fullmatch(version):
+            yield ErrorType.Error, f"{version} is not a valid version"
+
+        for name in ("pkgrel", "pkgdesc", "url", "license", "arch"):
+            if not self.variables.get(name, None):
+                yield ErrorType.Error, f"Missing {name} in APKBUILD"
+
+        # The arch and dependency syntax checks are vbuild's own, abuild
+        # doesn't print these messages
+        arch = self._words("arch")
+        for name in arch:
+            if not ARCH.fullmatch(name):
+                yield ErrorType.Error, f"{name} is not a valid arch"
+
+        if "noarch" in arch and len(arch) > 1:
+            yield ErrorType.Error, "noarch cannot be combined with other arches"
+
+        for name in ("depends", "makedepends", "checkdepends", "depends_dev"):
+            for dependency in self._words(name):
+                if not DEPENDENCY.fullmatch(dependency):
+                    yield (
+                        ErrorType.Error,
+                        f"{dependency} in {name} is not a valid dependency",
+                    )
+
+        pkgdesc = self.variables.get("pkgdesc", None)
+        # wc -c also counts the newline echo adds
+        if isinstance(pkgdesc, str) and len(f"{pkgdesc}\n".encode()) > 128:
+            yield ErrorType.Error, "pkgdesc is too long"
+
+        if "package" not in self.functions:
+            yield ErrorType.Error, "Missing package() function in APKBUILD"
+
+        for name in ("replaces_priority", "provider_priority"):
+            value = self.variables.get(name, None)
+            if value and not re.fullmatch(r"[0-9]+", " ".join(self._words(name))):
+                yield ErrorType.Error, f"{name} must be a number"
+
+        subpackages = [x.split(":", 1)[0] for x in self._words("subpackages")]
+        for name in [*self._words("pkgname"), *self._words("subpackages")]:
+            if name.startswith("-"):
+                yield (
+                    ErrorType.Error,
+                    f"{name.split(':', 1)[0]} is not a valid package name",
+                )
+
+        names = [pkgname, *subpackages]
+        install = self._words("install")
+        for script in install:
+            name, _, suffix = script.rpartition(".")
+            if suffix not in INSTALL_SUFFIXES:
+                yield ErrorType.Error, f"{script}: unknown install script suffix"
+
+            if name not in names:
+                yield (
+                    ErrorType.Error,
+                    f"{script}: install script does not match pkgname or any subpackage",
+                )
+
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, script)
+            if not os.path.exists(path):
+                yield ErrorType.Error, f"install script {script} is missing"
+                continue
+
+            with open(path) as f:
+                src = f.read()
+
+            for command in ("chown", "chmod", "chgrp"):
+                if command in src:
+                    yield ErrorType.Warning, f"{script}: found {command}"
+                    yield (
+                        ErrorType.Warning,
+                        "Permissions should be fixed in APKBUILD package()",
+                    )
+
+        source = self._words("source")
+
+        def source_has(name: str) -> bool:
+            return any(
+                name in (x.rsplit("/", 1)[-1], x.split("::", 1)[0]) for x in source
+            )
+
+        for trigger in self._words("triggers"):
+            script = trigger.rsplit("=", 1)[0]
+            name = script.removesuffix(".trigger")
+            if script == trigger:
+                yield ErrorType.Error, f"{script}: triggers must contain '='"
+
+            elif name == script:
+                yield (
+                    ErrorType.Error,
+                    f"{script}: triggers scripts must have .trigger suffix",
+                )
+
+            elif name not in names:
+                yield (
+                    ErrorType.Error,
+                    f"{name}: trigger does not match pkgname or any subpackage",
+                )
+
+            elif source_has(script):
+                yield ErrorType.Warning, "You should not have $triggers in source"
+
+            elif directory is not None and not os.path.exists(
+                os.path.join(directory, script)
+            ):
+                yield ErrorType.Error, f"trigger script {script} is missing"
+
+        checksums = {
+            algorithm: self._words(f"{algorithm}sums")
+            for algorithm in ("md5", "sha256", "sha512")
+        }
+        files = [x for sums in checksums.values() for x in sums]
+        for item in source:
+            if item in install:
+                yield ErrorType.Warning, "You should not have $install in source"
+                continue
+
+            if "::" in item:
+                item = item.split("::", 1)[0]  # noqa: PLW2901
+
+            elif item.startswith("https://") and "wget" in self._words("makedepends"):
+                yield (
+                    ErrorType.Warning,
+                    "wget no longer need to be in makedepends when source has https://",
+                )
+
+            name = item.rsplit("/", 1)[-1]
+            if name not in files:
+                yield ErrorType.Error, f"{name} is missing in checksums"
+
+            if "://" in item and name == f"v{pkgver}.tar.gz":
+                yield (
+                    ErrorType.Error,
+                    f"source {name} needs to be renamed to avoid possible collisions",
+                )
+
+        for algorithm, sums in checksums.items():
+            for name in sums[1::2]:
+                if not source_has(name):
+                    yield (
+                        ErrorType.Error,
+                        f"{name} exists in {algorithm}sums but is missing in $source",
+                    )
+
+        if self.variables.get("depend", None):
+            yield ErrorType.Error, "APKBUILD contains 'depend'. It should be depends"
+
+        if self.variables.get("makedepend", None):
+            yield (
+                ErrorType.Error,
+                "APKBUILD contains 'makedepend'. It should be makedepends",
+            )
+
+        options = self._words("options")
+        if "g++" in self._words("makedepends") and "toolchain" not in options:
+            yield ErrorType.Warning, "g++ should not be in makedepends"
+
+        if "!check" not in options and "check" not in self.functions:
+            yield (
+                ErrorType.Error,
+                "Testsuites (abuild check) are required or need to be explicitly disabled!",
+            )
+
     @typed_property
     def maintainer(self, value: str) -> str:
         return value
@@ -470,6 +836,9 @@ class APKBUILD:
 
     @property
     def _subpackages(self) -> dict[str, str]:
+        return self._memo("_subpackages", self._subpackage_map).copy()
+
+    def _subpackage_map(self) -> dict[str, str]:
         value = self.variables.get("subpackages", None)
         if value is None:
             return {}
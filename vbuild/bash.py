@@ -1,11 +1,14 @@
 # Based on https://github.com/toltec-dev/build/blob/main/toltec/bash.py
 
 import os
+import re
 import shlex
 import subprocess
 from io import StringIO
 from typing import cast
 
+from . import trace
+
 AssociativeArray = dict[str, str]
 IndexedArray = list[str | None]
 VariableValue = AssociativeArray | IndexedArray | str | None
@@ -131,13 +134,17 @@ class BashSyntaxError(Exception):
 def run_bash(src: str, env: dict[str, str] | None = None) -> str:
     env = {} if env is None else env.copy()
     env["PATH"] = os.environ["PATH"]
-    process = subprocess.run(
-        ["bash"],
-        input=src.encode(),
-        capture_output=True,
-        env=env,
-        check=False,
-    )
+    data = src.encode()
+    with trace.span("bash", "subprocess", bytes_in=len(data)) as span:
+        process = subprocess.run(
+            ["bash"],
+            input=data,
+            capture_output=True,
+            env=env,
+            check=False,
+        )
+        span.set(bytes_out=len(process.stdout), returncode=process.returncode)
+
     errors = process.stderr.decode()
     if process.returncode == 2 or "syntax error" in errors:
         raise BashSyntaxError(errors, src, 0)
@@ -160,6 +167,11 @@ def parse(src: str, env: dict[str, str] | None = None) -> tuple[Variables, Funct
     declarations = run_bash(
         src + "\n declare -f\n declare -p", {} if env is None else env
     )
+    with trace.span("bash.lex", "parse", bytes=len(declarations)):
+        return _lex(src, declarations)
+
+
+def _lex(src: str, declarations: str) -> tuple[Variables, Functions]:
     lexer = shlex.shlex(declarations, posix=True)
     lexer.wordchars = lexer.wordchars + "-"
     variables: Variables = {}
@@ -220,11 +232,52 @@ def parse_function(lexer: shlex.shlex) -> tuple[int, int]:
     return start, end
 
 
+ANSI_C_ESCAPES = {
+    "a": b"\a",
+    "b": b"\b",
+    "e": b"\x1b",
+    "E": b"\x1b",
+    "f": b"\f",
+    "n": b"\n",
+    "r": b"\r",
+    "t": b"\t",
+    "v": b"\v",
+    "\\": b"\\",
+    '"': b'"',
+    "?": b"?",
+}
+ANSI_C_ESCAPE = re.compile(r"\\(?:([abeEfnrtv\\\"?])|([0-7]{1,3})|x([0-9A-Fa-f]{1,2}))")
+
+
+def ansi_c_string(value: str) -> str:
+    # The escapes declare -p uses in $'...' strings, decoded without starting
+    # bash for each one. Anything else, and strings the lexer cut short at an
+    # escaped quote, are still left to bash.
+    trailing = len(value) - len(value.rstrip("\\"))
+    if trailing % 2 or re.search(r"\\[uUc]", value):
+        return run_bash("echo -n $" + shlex.quote(value))
+
+    data = bytearray()
+    offset = 0
+    for match in ANSI_C_ESCAPE.finditer(value):
+        data += value[offset : match.start()].encode()
+        escape, octal, hexadecimal = match.groups()
+        if escape is not None:
+            data += ANSI_C_ESCAPES[escape]
+
+        else:
+            data.append(int(octal or hexadecimal, 8 if octal else 16) & 0xFF)
+
+        offset = match.end()
+
+    data += value[offset:].encode()
+    return data.decode()
+
+
 def get_string(lexer: shlex.shlex) -> str:
     string_token = lexer.get_token() or ""
     if string_token == "$":  # noqa: S105
-        quoted_string = lexer.get_token() or ""
-        string_token = run_bash("echo -n $" + shlex.quote(quoted_string))
+        string_token = ansi_c_string(lexer.get_token() or "")
 
     return parse_string(string_token)
 
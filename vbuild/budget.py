@@ -0,0 +1,87 @@
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TextIO
+
+from . import trace
+
+# Span categories that are calls out of vbuild
+KINDS = ("subprocess", "daemon", "network")
+
+# (kind, name) -> [count, seconds]
+calls: dict[tuple[str, str], list[float]] = {}
+
+
+class BudgetExceededError(AssertionError):
+    pass
+
+
+def _on_span(name: str, category: str, duration: float, _: dict[str, object]) -> None:
+    if category not in KINDS:
+        return
+
+    entry = calls.setdefault((category, name), [0, 0.0])
+    entry[0] += 1
+    entry[1] += duration
+
+
+def enable() -> None:
+    trace.listen(_on_span)
+
+
+def disable() -> None:
+    trace.unlisten(_on_span)
+
+
+def reset() -> None:
+    calls.clear()
+
+
+def count(kind: str) -> int:
+    return int(sum(x[0] for (k, _), x in calls.items() if k == kind))
+
+
+def seconds(kind: str) -> float:
+    return sum(x[1] for (k, _), x in calls.items() if k == kind)
+
+
+@contextmanager
+def limit(**limits: int) -> Iterator[None]:
+    for kind in limits:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind of call {kind}")
+
+    # The CLI may already be counting calls for its summary
+    enabled = _on_span in trace.listeners
+    enable()
+    before = {kind: count(kind) for kind in limits}
+    try:
+        yield
+
+    finally:
+        if not enabled:
+            disable()
+
+    errors: list[str] = []
+    for kind, maximum in limits.items():
+        used = count(kind) - before[kind]
+        if used > maximum:
+            errors.append(f"{used} {kind} calls, expected at most {maximum}")
+
+    if errors:
+        raise BudgetExceededError(", ".join(errors))
+
+
+def summary(file: TextIO = sys.stderr) -> None:
+    if not calls:
+        return
+
+    name_width = max(len(name) for _, name in calls)
+    print(">>> External calls:", file=file)
+    for kind in KINDS:
+        for (call_kind, name), (number, duration) in sorted(calls.items()):
+            if call_kind == kind:
+                print(
+                    f"    {kind:<10}  {name:<{name_width}}  {int(number):4d} calls  {duration:8.3f} s",
+                    file=file,
+                )
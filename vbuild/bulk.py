@@ -0,0 +1,148 @@
+import itertools
+import json
+import os
+import sys
+import time
+from collections.abc import Callable
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)
+from typing import Literal
+
+from . import containers
+from .apkbuild import (
+    APKBUILD,
+    ErrorType,
+)
+from .apkbuild import parse as parse_apkbuild
+from .velbuild import VELBUILD
+from .velbuild import parse as parse_velbuild
+
+Result = dict[str, str | float | list[str] | None]
+
+
+def discover(root: str, filename: str = "VELBUILD") -> list[str]:
+    found: list[str] = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(x for x in dirnames if not x.startswith("."))
+        if filename in filenames:
+            found.append(directory)
+
+    return found
+
+
+def _init(runtime: Literal["podman", "docker"] | None) -> None:
+    VELBUILD.runtime = runtime
+
+
+def _result(
+    directory: str,
+    package: str | None,
+    errors: list[str],
+    warnings: list[str],
+    start: float,
+) -> Result:
+    return {
+        "directory": directory,
+        "package": package,
+        "status": "error" if errors else "ok",
+        "errors": errors,
+        "warnings": warnings,
+        "seconds": time.monotonic() - start,
+    }
+
+
+def gen(directory: str) -> Result:
+    start = time.monotonic()
+    package: APKBUILD | None = None
+    errors: list[str] = []
+    warnings: list[str] = []
+    try:
+        package = parse_velbuild(os.path.join(directory, "VELBUILD"))
+        for kind, msg in package.validate():
+            (errors if kind == ErrorType.Error else warnings).append(msg)
+
+        if not errors:
+            package.save(directory)
+
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+    pkgname = package.pkgname if package is not None else None
+    return _result(directory, pkgname, errors, warnings, start)
+
+
+def validate(directory: str) -> Result:
+    start = time.monotonic()
+    package: APKBUILD | None = None
+    errors: list[str] = []
+    warnings: list[str] = []
+    try:
+        package = parse_apkbuild(os.path.join(directory, "APKBUILD"))
+        for kind, msg in itertools.chain(
+            package.sanitycheck(directory), package.validate()
+        ):
+            (errors if kind == ErrorType.Error else warnings).append(msg)
+
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+    pkgname = package.pkgname if package is not None else None
+    return _result(directory, pkgname, errors, warnings, start)
+
+
+def _runtime() -> Literal["podman", "docker"] | None:
+    match os.environ.get("VBUILD_DRIVER", None):
+        case "podman":
+            return "podman"
+
+        case "docker":
+            return "docker"
+
+        case _:
+            try:
+                return containers.runtime()
+
+            except Exception:
+                # Only packages with an image and a build function need it
+                return None
+
+
+def run(
+    func: Callable[[str], Result],
+    root: str,
+    jobs: int | None = None,
+    filename: str = "VELBUILD",
+) -> int:
+    start = time.monotonic()
+    directories = discover(root, filename)
+    if not directories:
+        print(f">>> No {filename} files found in {root}", file=sys.stderr)
+        return 1
+
+    failed = 0
+    warned = 0
+    runtime = _runtime() if func is gen else None
+    with ProcessPoolExecutor(
+        max_workers=jobs or os.cpu_count(),
+        initializer=_init,
+        initargs=(runtime,),
+    ) as executor:
+        futures = [executor.submit(func, x) for x in directories]
+        for future in as_completed(futures):
+            result = future.result()
+            if result["status"] != "ok":
+                failed += 1
+
+            if result["warnings"]:
+                warned += 1
+
+            print(json.dumps(result), flush=True)
+
+    print(
+        f">>> {len(directories)} packages, {failed} failed, {warned} with warnings"
+        + f" in {time.monotonic() - start:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
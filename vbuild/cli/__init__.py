@@ -5,6 +5,14 @@ from typing import cast
 from rich.markdown import Markdown
 from rich_argparse import RichHelpFormatter
 
+from .. import (
+    budget,
+    metrics,
+    profiling,
+    substeps,
+    trace,
+)
+from ..context import Context
 from .__modules__ import (
     CommandCallable,
     commands,
@@ -13,6 +21,11 @@ from .__modules__ import (
 
 
 def main() -> int:
+    with profiling.profile():
+        return _main()
+
+
+def _main() -> int:
     try:
         parser = argparse.ArgumentParser(
             epilog=Markdown(  # pyright: ignore[reportArgumentType]
@@ -26,6 +39,14 @@ def main() -> int:
 | `$VBUILD_KEY_NAME` | Key name to use when signing packages. |
 | `$VBUILD_DRIVER` | Driver to use for running containers. Possible values are `podman` and `docker`. |
 | `$VBUILD_BUILDER_TAG` | Tag to use for the builder container. Defaults to `main`. |
+| `$VBUILD_BUILDER_CACHE_SIZE` | Number of builder containers with `makedepends` pre-installed to keep. Defaults to `10`. |
+| `$VBUILD_APK_CACHE_MAX_AGE` | Days an unused package is kept in the apk cache. Defaults to `30`. |
+| `$VBUILD_FETCH_JOBS` | Number of sources `checksum` downloads at once. Defaults to `8`. |
+| `$VBUILD_WATCH_INTERVAL` | Seconds between checks for changes with `watch --poll`. Defaults to `0.5`. |
+| `$VBUILD_HISTORY` | Build history database. Defaults to `~/.cache/vbuild/history.db`, set to an empty string to disable recording. |
+| `$VBUILD_METRICS` | Write counters and histograms to this file in the Prometheus text format, for use with node_exporter's textfile collector. Same as `--metrics`. |
+| `$VBUILD_PROFILE` | Profile vbuild itself. `cprofile[:FILE]` writes a pstats file, defaults to `vbuild.prof`. `sample[:FILE]` uses pyinstrument if it is installed, defaults to `vbuild-profile.html`. |
+| `$VBUILD_PROFILE_TOP` | Number of functions to show in the profile summary. Defaults to `25`. |
                     """,
                 style="argparse.txt",
             ),
@@ -42,6 +63,17 @@ def main() -> int:
             help="Verbose: show every command as it is run (very noisy)",
             action="store_true",
         )
+        _ = parser.add_argument(
+            "--trace",
+            help="Write a Chrome trace-event file of the run to FILE, this can be opened with https://ui.perfetto.dev",
+            metavar="FILE",
+        )
+        _ = parser.add_argument(
+            "--metrics",
+            help="Add the metrics of the run to the Prometheus textfile FILE",
+            metavar="FILE",
+            default=metrics.METRICS_PATH,
+        )
         parser.set_defaults(func=None)
         subparsers = parser.add_subparsers(help="COMMANDS")
         for name in sorted(modules.keys()):
@@ -51,14 +83,48 @@ def main() -> int:
                 **getattr(module, "kwds", {}),  # pyright:ignore [reportAny]
             )
             module.register(subparser)  # pyright:ignore [reportAny]
-            subparser.set_defaults(func=module.command)  # pyright:ignore [reportAny]
+            subparser.set_defaults(func=module.command, command=name)  # pyright:ignore [reportAny]
 
         args = parser.parse_args()
         func = cast(CommandCallable | None, args.func)
+        name = cast(str | None, getattr(args, "command", None)) or "all"
         if func is None:
             func = commands["all"]
 
-        return func(args)
+        trace_path = cast(str | None, args.trace)
+        if trace_path is not None:
+            trace.enable()
+
+        verbose = cast(bool, args.v)
+        if verbose:
+            budget.enable()
+
+        metrics_path = cast(str | None, args.metrics)
+        if metrics_path:
+            metrics.enable(metrics_path)
+
+        try:
+            with (
+                trace.span(f"vbuild {name}", "command") as span,
+                Context(cast(str, args.C), verbose=verbose) as context,
+            ):
+                try:
+                    with profiling.command(name):
+                        ret = func(args, context)
+
+                finally:
+                    substeps.summary(context.substeps)
+                    if verbose:
+                        budget.summary()
+
+                span.set(returncode=ret)
+                return ret
+
+        finally:
+            if trace_path is not None:
+                trace.save(trace_path)
+
+            metrics.save()
 
     except CalledProcessError as e:
         if e.stderr is not None:  # pyright: ignore[reportAny]
@@ -6,7 +6,9 @@ from collections.abc import Callable
 from glob import glob
 from types import ModuleType
 
-CommandCallable = Callable[[argparse.Namespace], int]
+from ..context import Context
+
+CommandCallable = Callable[[argparse.Namespace, Context], int]
 modules: dict[str, ModuleType] = {}
 commands: dict[str, CommandCallable] = {}
 
@@ -3,6 +3,8 @@ from argparse import (
     Namespace,
 )
 
+from ..context import Context
+
 kwds: dict[str, str] = {
     "help": "What does this do?",
 }
@@ -12,5 +14,5 @@ def register(_: ArgumentParser) -> None:
     pass
 
 
-def command(_: Namespace) -> int:
+def command(_: Namespace, __: Context) -> int:
     return 0
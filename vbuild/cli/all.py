@@ -1,8 +1,22 @@
+import os
+import sys
 from argparse import (
     ArgumentParser,
     Namespace,
 )
+from typing import cast
 
+from .. import trace
+from ..context import Context
+from ..stages import (
+    INCREMENTAL_STAGES,
+    STAGES,
+    load_state,
+    save_state,
+    skip_reason,
+    stamp,
+    up_to_date,
+)
 from .__modules__ import commands
 
 kwds: dict[str, str] = {
@@ -10,24 +24,109 @@ kwds: dict[str, str] = {
 }
 
 
-def register(_: ArgumentParser) -> None:
-    pass
+def register(parser: ArgumentParser) -> None:
+    _ = parser.add_argument(
+        "--incremental",
+        help="Keep src/ from the last run and skip clean, fetch, unpack, prepare and build while their inputs are unchanged",
+        action="store_true",
+    )
+    group = parser.add_mutually_exclusive_group()
+    _ = group.add_argument(
+        "--resume",
+        help="Start after the last stage that succeeded, unless the VELBUILD or APKBUILD changed since",
+        action="store_true",
+    )
+    _ = group.add_argument(
+        "--from",
+        help="Start at STAGE",
+        choices=STAGES,
+        dest="start",
+        metavar="STAGE",
+    )
+    _ = parser.add_argument(
+        "--to",
+        help="Stop after STAGE",
+        choices=STAGES,
+        dest="stop",
+        metavar="STAGE",
+    )
+
+
+def _first_stage(args: Namespace, context: Context) -> str | None:
+    start = cast(str | None, getattr(args, "start", None))
+    if start is not None or not getattr(args, "resume", False):
+        return start or STAGES[0]
+
+    completed = load_state(context.directory)
+    if completed is None:
+        print(">>> Nothing to resume, starting from the beginning")
+        return STAGES[0]
+
+    remaining = [x for x in STAGES if x not in completed]
+    if not remaining:
+        print(">>> Every stage succeeded in the last run, nothing to resume")
+        return None
+
+    print(f">>> Resuming from {remaining[0]}")
+    return remaining[0]
+
+
+def command(args: Namespace, context: Context) -> int:
+    incremental = cast(bool, getattr(args, "incremental", False))
+    first = _first_stage(args, context)
+    if first is None:
+        return 0
 
+    stop = cast(str | None, getattr(args, "stop", None)) or STAGES[-1]
+    if STAGES.index(stop) < STAGES.index(first):
+        print(f">>> ERROR: {stop} comes before {first}")
+        return 1
+
+    stages = STAGES[STAGES.index(first) : STAGES.index(stop) + 1]
+    # Stages before the first one only count as succeeded when the last run
+    # recorded them, --from doesn't run them
+    previous = load_state(context.directory) or []
+    completed = [x for x in STAGES[: STAGES.index(first)] if x in previous]
+    fresh: list[str] | None = None
+    for name in stages:
+        reason = None
+        if name not in ("gen", "validate"):
+            # The APKBUILD only exists once gen has run
+            if not os.path.exists(context.apkbuild_path):
+                print(f"{context.apkbuild_path} not found, run gen first")
+                return 1
+
+            apkbuild = context.apkbuild
+            if fresh is None:
+                # Whatever stage the run starts at, before anything changes src/
+                fresh = up_to_date(apkbuild, context.directory) if incremental else []
+
+            reason = skip_reason(apkbuild, name)
+            if reason is None and name in fresh:
+                reason = "its inputs have not changed since the last run"
+
+        if reason is not None:
+            if context.verbose:
+                print(
+                    f">>> {context.apkbuild.pkgname}: Skipping {name}, {reason}",
+                    file=sys.stderr,
+                )
+
+            completed.append(name)
+            save_state(context.directory, completed)
+            continue
+
+        with trace.span(name, "stage", directory=context.directory) as span:
+            ret = commands[name](args, context)
+            span.set(returncode=ret)
 
-def command(args: Namespace) -> int:
-    for name in [
-        "gen",
-        "validate",
-        "clean",
-        "fetch",
-        "unpack",
-        "prepare",
-        "build",
-        "check",
-        "rootpkg",
-    ]:
-        ret = commands[name](args)
         if ret:
             return ret
 
+        if name in INCREMENTAL_STAGES:
+            stamp(context.apkbuild, context.directory, name)
+
+        completed.append(name)
+        save_state(context.directory, completed)
+
     return 0
@@ -2,9 +2,8 @@ from argparse import (
     ArgumentParser,
     Namespace,
 )
-from typing import cast
 
-from ..abuild import abuild
+from ..context import Context
 
 kwds: dict[str, str] = {
     "help": "Compile and install the package into $pkgdir",
@@ -15,5 +14,5 @@ def register(_: ArgumentParser) -> None:
     pass
 
 
-def command(args: Namespace) -> int:
-    return abuild(cast(str, args.C), "build", verbose=cast(bool, args.v))
+def command(_: Namespace, context: Context) -> int:
+    return context.abuild("build")
@@ -4,11 +4,13 @@ from argparse import (
     ArgumentParser,
     Namespace,
 )
-from typing import cast
 
-from ..abuild import abuild
-from ..apkbuild import parse as parse_apkbuild
-from ..velbuild import parse as parse_velbuild
+from ..context import Context
+from ..distfiles import (
+    FetchError,
+    checksums,
+    sources,
+)
 from .gen import command as gen
 
 kwds: dict[str, str] = {
@@ -20,63 +22,82 @@ def register(_: ArgumentParser) -> None:
     pass
 
 
-def command(args: Namespace) -> int:
-    directory = cast(str, args.C)
-    apkbuild_path = os.path.join(directory, "APKBUILD")
-    ret = gen(args)
-    if ret:
-        return ret
-
-    ret = abuild(directory, "checksum", verbose=cast(bool, args.v))
-    if ret:
-        return ret
+def _abuild_checksums(context: Context) -> list[str] | None:
+    if context.abuild("checksum"):
+        return None
 
-    apkbuild = parse_apkbuild(apkbuild_path)
+    apkbuild = context.apkbuild
     assert apkbuild.sha512sums is not None
     assert isinstance(apkbuild.sha512sums, list)
     assert all([isinstance(x, str) for x in apkbuild.sha512sums])
-    velbuild_path = os.path.join(directory, "VELBUILD")
-    velbuild = parse_velbuild(velbuild_path)
-    print(f">>> {velbuild.pkgname}: Updating the sha512sums in {velbuild_path}...")
-    if velbuild.sha512sums == apkbuild.sha512sums:
-        return 0
+    tokens = apkbuild.sha512sums
+    return [f"{x}  {y}" for x, y in zip(tokens[::2], tokens[1::2], strict=True)]
+
 
-    with open(velbuild_path) as f:
+def _rewrite(path: str, sha512sums: list[str]) -> None:
+    with open(path) as f:
         lines_in = f.readlines()
 
-    in_block = False
     quote_character = ""
     lines_out: list[str] = []
     for line in lines_in:
         meaningful = line.strip()
-        if not in_block and meaningful.startswith("sha512sums="):
-            in_block = True
-            quote_character = ""
-            for character in ("'", '"'):
-                parts = meaningful.split(character)
-                if len(parts) == 0:
-                    continue
-
-                quote_character = character
-                if len(parts) > 2:
-                    in_block = False
-
-                break
-
-            if not quote_character:
-                raise Exception("Failed to find quote character on sha512sums= line")
+        if quote_character:
+            if meaningful.endswith(quote_character):
+                quote_character = ""
 
             continue
 
-        if in_block and meaningful.endswith(quote_character):
-            in_block = False
+        if not meaningful.startswith("sha512sums="):
+            lines_out.append(line)
             continue
 
-        if not in_block:
-            lines_out.append(line)
+        value = meaningful.removeprefix("sha512sums=")
+        if value[:1] in ("'", '"') and (len(value) == 1 or value[-1] != value[0]):
+            quote_character = value[0]
 
-    with open(velbuild_path, "w") as f:
+    value = shlex.quote(f"\n{'\n'.join(sha512sums)}\n")
+    with open(f"{path}.tmp", "w") as f:
         f.writelines(lines_out)
-        _ = f.write(f"sha512sums={shlex.quote('\n'.join(apkbuild.sha512sums))}")
+        _ = f.write(f"sha512sums={value}\n")
+
+    os.replace(f"{path}.tmp", path)
+
+
+def command(args: Namespace, context: Context) -> int:
+    ret = gen(args, context)
+    if ret:
+        return ret
+
+    velbuild = context.velbuild
+    files = sources(velbuild, context.directory)
+    sha512sums: list[str] | None
+    if all(x.supported for x in files):
+        missing = [x.name for x in files if x.remote and not x.cached]
+        if missing:
+            print(f">>> {velbuild.pkgname}: Fetching {', '.join(missing)}...")
+
+        try:
+            sha512sums = [
+                f"{x}  {y}" for x, y in checksums(velbuild, context.directory)
+            ]
+
+        except FetchError as e:
+            print(f">>> ERROR: {velbuild.pkgname}: {e}")
+            return 1
+
+    else:
+        # Let abuild fetch sources that use a scheme vbuild can't download
+        sha512sums = _abuild_checksums(context)
+        if sha512sums is None:
+            return 1
+
+    velbuild_path = context.velbuild_path
+    print(f">>> {velbuild.pkgname}: Updating the sha512sums in {velbuild_path}...")
+    if velbuild.sha512sums == " ".join(sha512sums).split():
+        return 0
 
+    _rewrite(velbuild_path, sha512sums)
+    velbuild.sha512sums = sha512sums
+    velbuild.save(context.directory)
     return 0
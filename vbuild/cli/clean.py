@@ -2,9 +2,10 @@ from argparse import (
     ArgumentParser,
     Namespace,
 )
-from typing import cast
 
-from ..abuild import abuild
+from .. import host
+from ..context import Context
+from ..stages import clear_stamps
 
 kwds: dict[str, str] = {
     "help": "",
@@ -15,5 +16,10 @@ def register(_: ArgumentParser) -> None:
     pass
 
 
-def command(args: Namespace) -> int:
-    return abuild(cast(str, args.C), "clean", verbose=cast(bool, args.v))
+def command(_: Namespace, context: Context) -> int:
+    clear_stamps(context.directory)
+    ret = host.clean(context.apkbuild, context.directory)
+    if ret is not None:
+        return ret
+
+    return context.abuild("clean")
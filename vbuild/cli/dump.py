@@ -0,0 +1,85 @@
+import os
+import sys
+from argparse import (
+    ArgumentParser,
+    Namespace,
+)
+from typing import cast
+
+from ..context import Context
+from ..model import (
+    MAGIC,
+    ModelError,
+    from_bytes,
+    from_json,
+    to_bytes,
+    to_json,
+)
+from ..velbuild import VELBUILD
+
+kwds: dict[str, str] = {
+    "help": "Write the parsed VELBUILD as a versioned model that can be loaded without bash",
+}
+
+
+def register(parser: ArgumentParser) -> None:
+    _ = parser.add_argument(
+        "--format",
+        help="Output format. Defaults to json",
+        choices=["json", "binary"],
+        default="json",
+    )
+    _ = parser.add_argument(
+        "--load",
+        help="Read a model written by dump from FILE instead of parsing the VELBUILD",
+        metavar="FILE",
+    )
+    _ = parser.add_argument(
+        "-o",
+        help="Write to FILE instead of stdout",
+        metavar="FILE",
+        dest="output",
+    )
+
+
+def _load(path: str) -> VELBUILD:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    return from_bytes(data) if data.startswith(MAGIC) else from_json(data)
+
+
+def command(args: Namespace, context: Context) -> int:
+    path = cast(str | None, args.load)
+    if path is not None:
+        try:
+            velbuild = _load(path)
+
+        except (OSError, ModelError) as e:
+            print(f"Unable to load {path}: {e}")
+            return 1
+
+    else:
+        filepath = context.velbuild_path
+        if not os.path.exists(filepath):
+            print(f"{filepath} not found")
+            return 1
+
+        velbuild = context.velbuild
+
+    if cast(str, args.format) == "binary":
+        data = to_bytes(velbuild)
+
+    else:
+        data = (to_json(velbuild) + "\n").encode()
+
+    output = cast(str | None, args.output)
+    if output is None:
+        _ = sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+
+    else:
+        with open(output, "wb") as f:
+            _ = f.write(data)
+
+    return 0
@@ -5,26 +5,39 @@ from argparse import (
 )
 from typing import cast
 
+from .. import bulk
 from ..apkbuild import ErrorType
-from ..velbuild import parse
+from ..context import Context
 
 kwds: dict[str, str] = {
     "help": "Generate the APKBUILD and install files for a given VELBUILD",
 }
 
 
-def register(_: ArgumentParser) -> None:
-    pass
+def register(parser: ArgumentParser) -> None:
+    _ = parser.add_argument(
+        "--all",
+        help="Generate every package below ROOT in parallel and print one JSON result per line",
+        metavar="ROOT",
+    )
+    _ = parser.add_argument(
+        "--jobs",
+        help="Number of packages to process at once with --all, defaults to the number of CPUs",
+        type=int,
+    )
 
 
-def command(args: Namespace) -> int:
-    directory = cast(str, args.C)
-    filepath = os.path.join(directory, "VELBUILD")
+def command(args: Namespace, context: Context) -> int:
+    root = cast(str | None, getattr(args, "all", None))
+    if root is not None:
+        return bulk.run(bulk.gen, root, cast(int | None, args.jobs), "VELBUILD")
+
+    filepath = context.velbuild_path
     if not os.path.exists(filepath):
         print(f"{filepath} not found")
         return 1
 
-    package = parse(filepath)
+    package = context.velbuild
     if package.pkgname is None:  # pyright: ignore[reportUnnecessaryComparison]
         raise Exception("pkgname is missing")
 
@@ -39,5 +52,8 @@ def command(args: Namespace) -> int:
     if fail:
         return 1
 
-    package.save(directory)
+    if package.image is not None and "build" in package.functions:
+        package.runtime = context.runtime
+
+    package.save(context.directory)
     return 0
@@ -0,0 +1,93 @@
+import os
+from argparse import (
+    ArgumentParser,
+    Namespace,
+)
+from typing import cast
+
+from ..context import Context
+from ..history import (
+    HISTORY_PATH,
+    cache_ratios,
+    connect,
+    regressions,
+    slowest,
+)
+
+kwds: dict[str, str] = {
+    "help": "Query the history of previous builds",
+}
+
+
+def register(parser: ArgumentParser) -> None:
+    group = parser.add_mutually_exclusive_group()
+    _ = group.add_argument(
+        "--slowest",
+        help="Show the stages that take the longest on average. This is the default",
+        action="store_const",
+        dest="view",
+        const="slowest",
+    )
+    _ = group.add_argument(
+        "--regressions",
+        help="Show stages where the latest build was slower than the rolling median",
+        action="store_const",
+        dest="view",
+        const="regressions",
+    )
+    _ = group.add_argument(
+        "--cache",
+        help="Show the hit ratio of each cache",
+        action="store_const",
+        dest="view",
+        const="cache",
+    )
+    _ = parser.add_argument(
+        "--limit",
+        help="Number of results to show for --slowest, or the number of previous builds to use for --regressions",
+        type=int,
+        default=10,
+    )
+    _ = parser.add_argument(
+        "--threshold",
+        help="Ratio above the rolling median that counts as a regression",
+        type=float,
+        default=0.2,
+    )
+    parser.set_defaults(view="slowest")
+
+
+def command(args: Namespace, _: Context) -> int:
+    if not HISTORY_PATH or not os.path.exists(HISTORY_PATH):
+        print("No build history recorded")
+        return 1
+
+    connection = connect(HISTORY_PATH)
+    try:
+        match cast(str, args.view):
+            case "regressions":
+                for package, stage, latest, median in regressions(
+                    connection,
+                    window=cast(int, args.limit),
+                    threshold=cast(float, args.threshold),
+                ):
+                    print(
+                        f"{package} {stage}: {latest:.1f}s (median {median:.1f}s, +{(latest / median - 1) if median else 0:.0%})"
+                    )
+
+            case "cache":
+                for name, hits, total in cache_ratios(connection):
+                    print(f"{name}: {hits}/{total} hits ({hits / total:.0%})")
+
+            case _:
+                for package, stage, average, maximum, count in slowest(
+                    connection, cast(int, args.limit)
+                ):
+                    print(
+                        f"{package} {stage}: {average:.1f}s average, {maximum:.1f}s max over {count} builds"
+                    )
+
+    finally:
+        connection.close()
+
+    return 0
@@ -2,9 +2,9 @@ from argparse import (
     ArgumentParser,
     Namespace,
 )
-from typing import cast
 
-from ..abuild import abuild
+from .. import host
+from ..context import Context
 
 kwds: dict[str, str] = {
     "help": "",
@@ -15,5 +15,9 @@ def register(_: ArgumentParser) -> None:
     pass
 
 
-def command(args: Namespace) -> int:
-    return abuild(cast(str, args.C), "unpack", verbose=cast(bool, args.v))
+def command(_: Namespace, context: Context) -> int:
+    ret = host.unpack(context.apkbuild, context.directory)
+    if ret is not None:
+        return ret
+
+    return context.abuild("unpack")
@@ -1,42 +1,91 @@
+import itertools
 import os
+import threading
 from argparse import (
     ArgumentParser,
     Namespace,
 )
+from concurrent.futures import ThreadPoolExecutor
 from typing import cast
 
-from ..abuild import abuild
+from .. import bulk
 from ..apkbuild import (
+    APKBUILD,
     ErrorType,
-    parse,
 )
+from ..context import Context
 
 kwds: dict[str, str] = {
     "help": "check the APKBUILD file for violations of policy, superfluous statements, stylistic violations and others",
 }
 
 
-def register(_: ArgumentParser) -> None:
-    pass
+def register(parser: ArgumentParser) -> None:
+    _ = parser.add_argument(
+        "--all",
+        help="Validate every package below ROOT in parallel and print one JSON result per line",
+        metavar="ROOT",
+    )
+    _ = parser.add_argument(
+        "--jobs",
+        help="Number of packages to process at once with --all, defaults to the number of CPUs",
+        type=int,
+    )
+    _ = parser.add_argument(
+        "--strict-abuild",
+        help="Also run abuild validate in the builder container",
+        action="store_true",
+    )
 
 
-def command(args: Namespace) -> int:
-    ret = abuild(cast(str, args.C), "validate", verbose=cast(bool, args.v))
-    if ret:
-        return ret
+def _findings(package: APKBUILD, directory: str) -> list[tuple[ErrorType, str]]:
+    return list(itertools.chain(package.sanitycheck(directory), package.validate()))
 
-    directory = cast(str, args.C)
-    filepath = os.path.join(directory, "APKBUILD")
-    if not os.path.exists(filepath):
-        print(f"{filepath} not found")
-        return 1
 
-    package = parse(filepath)
+def _report(package: APKBUILD, findings: list[tuple[ErrorType, str]]) -> bool:
     fail = False
-    for type, msg in package.validate():
+    for type, msg in findings:
         if type == ErrorType.Error:
             fail = True
 
         print(f">>> {ErrorType.string(type).upper()}: {package.pkgname}: {msg}")
 
-    return 1 if fail else 0
+    return fail
+
+
+def command(args: Namespace, context: Context) -> int:
+    root = cast(str | None, getattr(args, "all", None))
+    if root is not None:
+        return bulk.run(bulk.validate, root, cast(int | None, args.jobs), "APKBUILD")
+
+    filepath = context.apkbuild_path
+    if not os.path.exists(filepath):
+        print(f"{filepath} not found")
+        return 1
+
+    package = context.apkbuild
+    if not getattr(args, "strict_abuild", False):
+        return 1 if _report(package, _findings(package, context.directory)) else 0
+
+    # Start abuild's checks in the builder container and run the local checks
+    # while it starts, an error found locally stops the container early. The
+    # local findings are printed after abuild's output so the two don't mix.
+    cancel = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(context.abuild, "validate", cancel)
+        findings = _findings(package, context.directory)
+        if any(x == ErrorType.Error for x, _ in findings):
+            cancel.set()
+
+        ret = future.result()
+
+    if _report(package, findings):
+        return 1
+
+    if ret:
+        print(
+            f">>> ERROR: {package.pkgname}: abuild validate failed but the checks"
+            + " in vbuild passed, please report this as a bug"
+        )
+
+    return ret
@@ -0,0 +1,163 @@
+import os
+from argparse import (
+    ArgumentParser,
+    Namespace,
+)
+from typing import cast
+
+from ..abuild import Session
+from ..apkbuild import APKBUILD
+from ..context import Context
+from ..distfiles import sources
+from ..host import (
+    TAR_MODES,
+    UNSUPPORTED,
+)
+from ..stages import (
+    STAGES,
+    fingerprint,
+)
+from ..watch import watcher
+from .__modules__ import commands
+
+kwds: dict[str, str] = {
+    "help": "Rebuild the package every time the VELBUILD or one of its local sources changes",
+}
+
+# Local sources that are extracted by unpack or applied by prepare, src/ has to
+# be recreated when they change
+UNPACKED = (*TAR_MODES, *UNSUPPORTED, ".zip", ".patch")
+
+
+def register(parser: ArgumentParser) -> None:
+    _ = parser.add_argument(
+        "--poll",
+        help="Check for changes every $VBUILD_WATCH_INTERVAL seconds instead of using inotify",
+        action="store_true",
+    )
+
+
+def _paths(context: Context) -> dict[str, str]:
+    # What each watched file is used for
+    paths = {os.path.abspath(context.velbuild_path): "velbuild"}
+    try:
+        apkbuild = context.apkbuild
+        units = {os.path.basename(x) for x in context.velbuild.systemdunits}
+
+    except FileNotFoundError:
+        return paths
+
+    for source in sources(apkbuild, context.directory):
+        if source.remote:
+            continue
+
+        path = os.path.abspath(source.path)
+        if source.name.endswith(UNPACKED):
+            paths[path] = "unpacked"
+
+        elif source.name in units:
+            paths[path] = "unit"
+
+        else:
+            paths[path] = "source"
+
+    return paths
+
+
+def affected(before: APKBUILD | None, after: APKBUILD) -> str:
+    # The first stage that has to run again after the APKBUILD changed, prepare
+    # changes src/ so it can only run again after a new clean and unpack
+    if before is None or fingerprint(before, "prepare") != fingerprint(
+        after, "prepare"
+    ):
+        return "clean"
+
+    if fingerprint(before, "build") != fingerprint(after, "build"):
+        return "build"
+
+    if before.check != after.check:
+        return "check"
+
+    return "rootpkg"
+
+
+def first_stage(kinds: set[str], before: APKBUILD | None, after: APKBUILD) -> str:
+    if "unpacked" in kinds:
+        return "clean"
+
+    first = affected(before, after) if "velbuild" in kinds else "rootpkg"
+    if "source" in kinds and STAGES.index(first) > STAGES.index("build"):
+        # Anything else is linked into src/ and could be used by build()
+        return "build"
+
+    return first
+
+
+def _all(context: Context, start: str, stop: str | None = None) -> int:
+    return commands["all"](
+        Namespace(start=start, stop=stop, resume=False, incremental=False), context
+    )
+
+
+def _apkbuild(context: Context) -> APKBUILD | None:
+    try:
+        return context.apkbuild
+
+    except FileNotFoundError:
+        return None
+
+
+def command(args: Namespace, context: Context) -> int:
+    if not os.path.exists(context.velbuild_path):
+        print(f"{context.velbuild_path} not found")
+        return 1
+
+    with Session(context.directory, context.client, verbose=context.verbose) as session:
+        context.session = session
+        paths = _paths(context)
+        files = watcher(list(paths), poll=cast(bool, args.poll))
+        try:
+            start: str | None = "gen"
+            # Where the last build that failed started, the next one has to
+            # run those stages again
+            failed: str | None = None
+            while True:
+                if start is not None:
+                    ret = _all(context, start)
+                    failed = start if ret else None
+                    print(
+                        f">>> {'Build failed' if ret else 'Build succeeded'}, waiting for changes..."
+                    )
+
+                paths = _paths(context)
+                files.watch(list(paths))
+                changed = files.wait()
+                print(
+                    f">>> {', '.join(os.path.relpath(x, context.directory) for x in changed)} changed"
+                )
+                kinds = {paths[x] for x in changed if x in paths}
+                before = _apkbuild(context)
+                start = None
+                if "velbuild" in kinds and _all(context, "gen", "validate"):
+                    print(">>> Waiting for changes...")
+                    continue
+
+                after = _apkbuild(context)
+                if after is None:
+                    continue
+
+                start = first_stage(kinds, before, after)
+                if failed is not None and STAGES.index(failed) < STAGES.index(start):
+                    # gen and validate already ran again for a new VELBUILD
+                    if "velbuild" in kinds and failed in ("gen", "validate"):
+                        start = "clean"
+
+                    else:
+                        start = failed
+
+        except KeyboardInterrupt:
+            return 0
+
+        finally:
+            files.close()
+            context.session = None
@@ -1,6 +1,9 @@
 import json
 import os
-from collections.abc import Generator
+from collections.abc import (
+    Generator,
+    Iterator,
+)
 from contextlib import contextmanager
 from typing import (
     Any,
@@ -9,7 +12,14 @@ from typing import (
 )
 
 import docker
+import docker.errors
+import docker.models.containers
 import podman
+import podman.api
+import podman.domain.containers
+import podman.errors
+
+from . import trace
 
 
 def parse_progress(x: dict[str, Any]) -> str:  # pyright: ignore[reportExplicitAny]
@@ -29,7 +39,10 @@ def parse_progress(x: dict[str, Any]) -> str:  # pyright: ignore[reportExplicitA
 
 
 def pull(
-    client: podman.PodmanClient | docker.DockerClient, repository: str, tag: str
+    client: podman.PodmanClient | docker.DockerClient,
+    repository: str,
+    tag: str,
+    layers: dict[str, int] | None = None,
 ) -> Generator[str, None, None]:
     if isinstance(client, podman.PodmanClient):
         yield f"Pulling from {repository} {tag}"
@@ -40,9 +53,76 @@ def pull(
 
     assert isinstance(logs, Generator), f"Not a generator: {logs}"
     for x in logs:  # pyright: ignore[reportUnknownVariableType]
-        yield parse_progress(
-            json.loads(x) if isinstance(client, podman.PodmanClient) else x  # pyright: ignore[reportArgumentType, reportUnknownArgumentType]
+        progress = cast(
+            dict[str, Any],  # pyright: ignore[reportExplicitAny]
+            json.loads(x) if isinstance(client, podman.PodmanClient) else x,  # pyright: ignore[reportArgumentType, reportUnknownArgumentType]
+        )
+        if layers is not None and "total" in progress.get("progressDetail", {}):
+            layers[cast(str, progress.get("id", ""))] = cast(
+                int, progress["progressDetail"]["total"]
+            )
+
+        yield parse_progress(progress)
+
+
+def create(
+    client: podman.PodmanClient | docker.DockerClient,
+    image: str,
+    command: list[str],
+    **kwargs: Any,  # pyright: ignore[reportExplicitAny, reportAny]
+) -> podman.domain.containers.Container | docker.models.containers.Container:
+    try:
+        return client.containers.create(image, command, **kwargs)  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType, reportAny]
+
+    except (docker.errors.ImageNotFound, podman.errors.ImageNotFound):
+        repository, tag = image.rsplit(":", 1)
+        with trace.span("pull", "daemon", image=repository, tag=tag):
+            for _ in pull(client, repository, tag):
+                pass
+
+        return client.containers.create(image, command, **kwargs)  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType, reportAny]
+
+
+def exec_start(
+    client: podman.PodmanClient | docker.DockerClient,
+    container: podman.domain.containers.Container | docker.models.containers.Container,
+    command: list[str],
+) -> tuple[str, Iterator[bytes]]:
+    # Container.exec_run doesn't return the exit code when streaming, so the
+    # exec is created by hand and its id kept for exec_inspect
+    if isinstance(client, podman.PodmanClient):
+        response = client.api.post(
+            f"/containers/{container.id}/exec",
+            data=json.dumps(
+                {"AttachStdout": True, "AttachStderr": True, "Cmd": command}
+            ),
         )
+        response.raise_for_status()
+        exec_id = cast(str, response.json()["Id"])
+        response = client.api.post(
+            f"/exec/{exec_id}/start",
+            data=json.dumps({"Detach": False, "Tty": False}),
+            stream=True,
+        )
+        response.raise_for_status()
+        return exec_id, cast(Iterator[bytes], podman.api.stream_frames(response))
+
+    exec_id = cast(str, client.api.exec_create(container.id, command)["Id"])  # pyright: ignore[reportUnknownMemberType]
+    return exec_id, cast(
+        Iterator[bytes],
+        client.api.exec_start(exec_id, stream=True),  # pyright: ignore[reportUnknownMemberType]
+    )
+
+
+def exec_inspect(
+    client: podman.PodmanClient | docker.DockerClient, exec_id: str
+) -> dict[str, Any]:  # pyright: ignore[reportExplicitAny]
+    if isinstance(client, podman.PodmanClient):
+        response = client.api.get(f"/exec/{exec_id}/json")
+        response.raise_for_status()
+        return cast(dict[str, Any], response.json())  # pyright: ignore[reportExplicitAny]
+
+    return cast(dict[str, Any], client.api.exec_inspect(exec_id))  # pyright: ignore[reportExplicitAny, reportUnknownMemberType]
 
 
 @contextmanager
@@ -61,8 +141,11 @@ def from_env() -> Generator[podman.PodmanClient, None, None]:
     for driver in drivers:
         client: podman.PodmanClient | None = None
         try:
-            client = cast(podman.PodmanClient, driver.from_env())  # pyright: ignore[reportAny]
-            if not client.ping():
+            with trace.span("connect", "daemon", driver=driver.__name__):
+                client = cast(podman.PodmanClient, driver.from_env())  # pyright: ignore[reportAny]
+                alive = client.ping()
+
+            if not alive:
                 client.close()
                 continue
 
@@ -86,12 +169,17 @@ def from_env() -> Generator[podman.PodmanClient, None, None]:
         raise ExceptionGroup("Unable to connect to docker or podman", errors)
 
 
-def runtime() -> Literal["podman", "docker"] | None:
-    with from_env() as client:
-        if isinstance(client, podman.PodmanClient):  # pyright: ignore[reportUnnecessaryIsInstance]
-            return "podman"
+def runtime(
+    client: podman.PodmanClient | docker.DockerClient | None = None,
+) -> Literal["podman", "docker"] | None:
+    if client is None:
+        with from_env() as env_client:
+            return runtime(env_client)
+
+    if isinstance(client, podman.PodmanClient):
+        return "podman"
 
-        if isinstance(client, docker.DockerClient):  # pyright: ignore[reportUnnecessaryIsInstance]
-            return "docker"
+    if isinstance(client, docker.DockerClient):  # pyright: ignore[reportUnnecessaryIsInstance]
+        return "docker"
 
-        return None
+    return None
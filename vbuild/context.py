@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from hashlib import sha256
+from typing import (
+    Literal,
+    Self,
+)
+
+import docker
+import podman
+
+from . import (
+    containers,
+    history,
+    metrics,
+    trace,
+)
+from .abuild import (
+    Session,
+    abuild,
+)
+from .apkbuild import APKBUILD
+from .apkbuild import parse as parse_apkbuild
+from .distfiles import sources
+from .history import StageRecord
+from .substeps import (
+    Substep,
+    SubstepTimer,
+)
+from .velbuild import VELBUILD
+from .velbuild import parse as parse_velbuild
+
+
+def digest(path: str) -> str | None:
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        return sha256(f.read()).hexdigest()
+
+
+class Context:
+    def __init__(self, directory: str, verbose: bool = False) -> None:
+        self.directory: str = directory
+        self.verbose: bool = verbose
+        self._stack: ExitStack = ExitStack()
+        self._client: podman.PodmanClient | docker.DockerClient | None = None
+        self._runtime: Literal["podman", "docker"] | None = None
+        self._velbuild: tuple[str, VELBUILD] | None = None
+        self._apkbuild: tuple[str, APKBUILD] | None = None
+        self.substeps: list[Substep] = []
+        self.hits: dict[str, bool] = {}
+        self.session: Session | None = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._stack.close()
+        self._client = None
+        self._runtime = None
+
+    @property
+    def velbuild_path(self) -> str:
+        return os.path.join(self.directory, "VELBUILD")
+
+    @property
+    def apkbuild_path(self) -> str:
+        return os.path.join(self.directory, "APKBUILD")
+
+    @property
+    def velbuild(self) -> VELBUILD:
+        path = self.velbuild_path
+        current = digest(path)
+        if current is None:
+            raise FileNotFoundError(path)
+
+        cached = self._velbuild
+        self.hits["velbuild"] = cached is not None and cached[0] == current
+        metrics.inc(
+            "vbuild_cache_requests_total",
+            cache="velbuild",
+            result="hit" if self.hits["velbuild"] else "miss",
+        )
+        if cached is None or cached[0] != current:
+            cached = (current, parse_velbuild(path))
+            self._velbuild = cached
+
+        return cached[1]
+
+    @property
+    def apkbuild(self) -> APKBUILD:
+        path = self.apkbuild_path
+        current = digest(path)
+        if current is None:
+            raise FileNotFoundError(path)
+
+        cached = self._apkbuild
+        self.hits["apkbuild"] = cached is not None and cached[0] == current
+        metrics.inc(
+            "vbuild_cache_requests_total",
+            cache="apkbuild",
+            result="hit" if self.hits["apkbuild"] else "miss",
+        )
+        if cached is None or cached[0] != current:
+            cached = (current, parse_apkbuild(path))
+            self._apkbuild = cached
+
+        return cached[1]
+
+    @property
+    def client(self) -> podman.PodmanClient | docker.DockerClient:
+        if self._client is None:
+            self._client = self._stack.enter_context(containers.from_env())
+
+        return self._client
+
+    @property
+    def runtime(self) -> Literal["podman", "docker"]:
+        if self._runtime is None:
+            self._runtime = containers.runtime(self.client)
+            assert self._runtime is not None
+
+        return self._runtime
+
+    def _distfiles_hit(self, apkbuild: APKBUILD) -> bool:
+        hit = True
+        for source in sources(apkbuild, self.directory):
+            if not source.remote:
+                continue
+
+            exists = source.cached
+            metrics.inc(
+                "vbuild_cache_requests_total",
+                cache="distfiles",
+                result="hit" if exists else "miss",
+            )
+            hit = hit and exists
+
+        return hit
+
+    def abuild(self, action: str, cancel: threading.Event | None = None) -> int:
+        apkbuild = self.apkbuild
+        record = StageRecord(
+            apkbuild.pkgname, f"{apkbuild.pkgver}-r{apkbuild.pkgrel}", action
+        )
+        with trace.span(
+            "abuild",
+            "stage",
+            package=apkbuild.pkgname,
+            arch=record.arch,
+            stage=action,
+        ) as span:
+            timer = SubstepTimer(apkbuild.pkgname, action)
+            record.cache["apkbuild"] = self.hits["apkbuild"]
+            if action == "fetch":
+                record.cache["distfiles"] = self._distfiles_hit(apkbuild)
+
+            start = time.monotonic()
+            ret: int | None = None
+            try:
+                if self.session is not None:
+                    ret = self.session.run(
+                        action, apkbuild.makedepends or [], timer, record
+                    )
+
+                else:
+                    ret = abuild(
+                        self.directory,
+                        action,
+                        verbose=self.verbose,
+                        makedepends=apkbuild.makedepends or [],
+                        client=self.client,
+                        timer=timer,
+                        record=record,
+                        cancel=cancel,
+                    )
+
+            finally:
+                self.substeps.extend(timer.finish())
+                record.duration = time.monotonic() - start
+                record.exit_code = ret
+                try:
+                    history.record(record)
+
+                except (sqlite3.Error, OSError) as e:
+                    print(f"Unable to record build history: {e}", file=sys.stderr)
+
+            assert ret is not None
+            span.set(returncode=ret)
+
+        return ret
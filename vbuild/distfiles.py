@@ -0,0 +1,109 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import (
+    Request,
+    build_opener,
+)
+
+from . import trace
+from .abuild import distfiles_dir
+from .apkbuild import APKBUILD
+
+FETCH_JOBS = int(os.environ.get("VBUILD_FETCH_JOBS", "8"))
+SCHEMES = ("http", "https", "ftp")
+# Bytes read at a time when downloading and hashing
+BUFFER_SIZE = 1024 * 1024
+
+
+class FetchError(Exception):
+    pass
+
+
+class Source:
+    def __init__(self, directory: str, source: str) -> None:
+        name, _, url = source.partition("::")
+        if not url:
+            url = source
+            name = os.path.basename(source)
+
+        self.url: str | None = url if "://" in url else None
+        # Same file name abuild uses in $SRCDEST and sha512sums
+        self.name: str = name
+        self.path: str = (
+            os.path.join(distfiles_dir(directory), self.name)
+            if self.url is not None
+            else os.path.join(directory, source)
+        )
+
+    @property
+    def remote(self) -> bool:
+        return self.url is not None
+
+    @property
+    def supported(self) -> bool:
+        return self.url is None or urlparse(self.url).scheme in SCHEMES
+
+    @property
+    def cached(self) -> bool:
+        return os.path.exists(self.path)
+
+
+def sources(apkbuild: APKBUILD, directory: str) -> list[Source]:
+    return [Source(directory, x) for x in apkbuild.source or []]
+
+
+def fetch(source: Source) -> None:
+    assert source.url is not None
+    os.makedirs(os.path.dirname(source.path), exist_ok=True)
+    partial = f"{source.path}.part"
+    request = Request(source.url, headers={"User-Agent": "vbuild"})  # noqa: S310
+    with trace.span("fetch", "network", url=source.url) as span:
+        try:
+            with (
+                build_opener().open(request, timeout=30) as res,  # pyright: ignore[reportAny]
+                open(partial, "wb") as f,
+            ):
+                shutil.copyfileobj(res, f, BUFFER_SIZE)  # pyright: ignore[reportAny]
+                span.set(bytes=f.tell())
+
+        except OSError as e:
+            if os.path.exists(partial):
+                os.unlink(partial)
+
+            raise FetchError(f"Failed to fetch {source.url}: {e}") from e
+
+    os.replace(partial, source.path)
+
+
+def sha512(path: str) -> str:
+    with trace.span("sha512", "hash", path=path), open(path, "rb") as f:
+        # hashlib releases the GIL while hashing large buffers, so this
+        # runs in parallel across threads
+        digest = hashlib.sha512()
+        buffer = bytearray(BUFFER_SIZE)
+        view = memoryview(buffer)
+        while size := f.readinto(buffer):
+            digest.update(view[:size])
+
+        return digest.hexdigest()
+
+
+def checksums(
+    apkbuild: APKBUILD, directory: str, jobs: int = FETCH_JOBS
+) -> list[tuple[str, str]]:
+    files = sources(apkbuild, directory)
+    for source in files:
+        if not source.remote and not os.path.exists(source.path):
+            raise FetchError(f"{source.name} not found")
+
+    missing = [x for x in files if x.remote and not x.cached]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for _ in executor.map(fetch, missing):
+            pass
+
+        return list(
+            zip(executor.map(sha512, [x.path for x in files]), [x.name for x in files])
+        )
@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections.abc import Iterator
+from typing import (
+    Any,
+    cast,
+)
+
+import docker.models.containers
+import podman.domain.containers
+
+# Set to an empty string to disable recording
+HISTORY_PATH = os.environ.get(
+    "VBUILD_HISTORY", os.path.expanduser("~/.cache/vbuild/history.db")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    package TEXT NOT NULL,
+    version TEXT,
+    arch TEXT NOT NULL,
+    builder TEXT,
+    stage TEXT NOT NULL,
+    duration REAL NOT NULL,
+    exit_code INTEGER,
+    peak_memory INTEGER,
+    cpu_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS stages_package ON stages (package, stage, started);
+CREATE TABLE IF NOT EXISTS cache (
+    stage_id INTEGER NOT NULL REFERENCES stages (id),
+    name TEXT NOT NULL,
+    hit INTEGER NOT NULL
+);
+"""
+
+
+class StageRecord:
+    def __init__(self, package: str, version: str | None, stage: str) -> None:
+        self.package: str = package
+        self.version: str | None = version
+        self.arch: str = os.environ.get("CARCH", "noarch")
+        self.stage: str = stage
+        self.started: float = time.time()
+        self.duration: float = 0.0
+        self.exit_code: int | None = None
+        self.builder: str | None = None
+        self.peak_memory: int | None = None
+        self.cpu_seconds: float | None = None
+        self.cache: dict[str, bool] = {}
+
+
+def _stats_sample(
+    sample: dict[str, Any],  # pyright: ignore[reportExplicitAny]
+) -> tuple[int | None, float | None]:
+    if "Stats" in sample:
+        # podman
+        stats = sample["Stats"] or [{}]  # pyright: ignore[reportAny]
+        memory = stats[0].get("MemUsage")  # pyright: ignore[reportAny]
+        cpu = stats[0].get("CPUNano")  # pyright: ignore[reportAny]
+
+    else:
+        # docker
+        memory = sample.get("memory_stats", {}).get("usage")  # pyright: ignore[reportAny]
+        cpu = sample.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage")  # pyright: ignore[reportAny]
+
+    return (
+        int(memory) if memory else None,  # pyright: ignore[reportAny]
+        int(cpu) / 1e9 if cpu else None,  # pyright: ignore[reportAny]
+    )
+
+
+def watch_stats(
+    container: podman.domain.containers.Container | docker.models.containers.Container,
+    record: StageRecord,
+) -> threading.Thread:
+    def run() -> None:
+        try:
+            stream = container.stats(stream=True, decode=True)  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+            assert isinstance(stream, Iterator)
+            for sample in stream:  # pyright: ignore[reportUnknownVariableType]
+                memory, cpu = _stats_sample(cast(dict[str, Any], sample))  # pyright: ignore[reportExplicitAny]
+                if memory is not None:
+                    record.peak_memory = max(record.peak_memory or 0, memory)
+
+                if cpu is not None:
+                    record.cpu_seconds = max(record.cpu_seconds or 0.0, cpu)
+
+        except Exception:  # noqa: S110
+            # The container is gone, or the engine doesn't support stats
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def connect(path: str = HISTORY_PATH) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    connection = sqlite3.connect(path, timeout=30)
+    _ = connection.executescript(SCHEMA)
+    return connection
+
+
+def record(stage: StageRecord, path: str = HISTORY_PATH) -> None:
+    if not path:
+        return
+
+    with connect(path) as connection:
+        cursor = connection.execute(
+            "INSERT INTO stages (started, package, version, arch, builder, stage,"
+            " duration, exit_code, peak_memory, cpu_seconds)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                stage.started,
+                stage.package,
+                stage.version,
+                stage.arch,
+                stage.builder,
+                stage.stage,
+                stage.duration,
+                stage.exit_code,
+                stage.peak_memory,
+                stage.cpu_seconds,
+            ),
+        )
+        _ = connection.executemany(
+            "INSERT INTO cache (stage_id, name, hit) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, name, hit) for name, hit in stage.cache.items()],
+        )
+
+    connection.close()
+
+
+def slowest(
+    connection: sqlite3.Connection, limit: int = 10
+) -> list[tuple[str, str, float, float, int]]:
+    return connection.execute(
+        "SELECT package, stage, AVG(duration), MAX(duration), COUNT(*)"
+        " FROM stages WHERE exit_code = 0"
+        " GROUP BY package, stage ORDER BY AVG(duration) DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+
+
+def regressions(
+    connection: sqlite3.Connection, window: int = 10, threshold: float = 0.2
+) -> list[tuple[str, str, float, float]]:
+    durations: dict[tuple[str, str], list[float]] = {}
+    for package, stage, duration in connection.execute(
+        "SELECT package, stage, duration FROM stages WHERE exit_code = 0"
+        " ORDER BY started"
+    ):
+        durations.setdefault((package, stage), []).append(duration)  # pyright: ignore[reportAny]
+
+    found: list[tuple[str, str, float, float]] = []
+    for (package, stage), values in durations.items():
+        if len(values) < 2:
+            continue
+
+        latest = values[-1]
+        median = statistics.median(values[-window - 1 : -1])
+        if latest > median * (1 + threshold):
+            found.append((package, stage, latest, median))
+
+    return sorted(found, key=lambda x: x[2] / x[3] if x[3] else 0, reverse=True)
+
+
+def cache_ratios(connection: sqlite3.Connection) -> list[tuple[str, int, int]]:
+    return connection.execute(
+        "SELECT name, SUM(hit), COUNT(*) FROM cache GROUP BY name ORDER BY name"
+    ).fetchall()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+
+from . import trace
+from .apkbuild import APKBUILD
+from .distfiles import (
+    Source,
+    sha512,
+    sources,
+)
+
+# tarfile stream modes for the archives abuild's default_unpack extracts,
+# lzip and zstd archives are left to abuild
+TarMode = Literal["r|", "r|gz", "r|bz2", "r|xz"]
+TAR_MODES: dict[str, TarMode] = {
+    ".tar": "r|",
+    ".tar.gz": "r|gz",
+    ".tgz": "r|gz",
+    ".tar.bz2": "r|bz2",
+    ".tar.xz": "r|xz",
+    ".tar.lzma": "r|xz",
+}
+UNSUPPORTED = (".tar.lz", ".tar.zst", ".initd")
+
+
+def clean(apkbuild: APKBUILD, directory: str) -> int | None:
+    if "clean" in apkbuild.functions:
+        return None
+
+    print(f">>> {apkbuild.pkgname}: Cleaning temporary build dirs...")
+    with trace.span("clean", "host", package=apkbuild.pkgname):
+        for name in ("src", "pkg"):
+            try:
+                shutil.rmtree(os.path.join(directory, name))
+
+            except FileNotFoundError:
+                pass
+
+            except PermissionError:
+                # Created by root in the builder container
+                return None
+
+    return 0
+
+
+def _mode(path: str) -> TarMode | None:
+    for suffix, mode in TAR_MODES.items():
+        if path.endswith(suffix):
+            return mode
+
+    return None
+
+
+def _verified(apkbuild: APKBUILD, files: list[Source]) -> bool:
+    tokens = apkbuild.sha512sums or []
+    if len(tokens) % 2:
+        return False
+
+    expected = dict(zip(tokens[1::2], tokens[::2], strict=True))
+    if any(x.name not in expected or not os.path.exists(x.path) for x in files):
+        return False
+
+    with ThreadPoolExecutor() as executor:
+        actual = executor.map(sha512, [x.path for x in files])
+        return all(
+            digest == expected[x.name] for x, digest in zip(files, actual, strict=True)
+        )
+
+
+def _extract_zip(path: str, srcdir: str) -> None:
+    root = os.path.realpath(srcdir)
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            parts = member.filename.split("/")
+            if member.filename.startswith("/") or ".." in parts:
+                raise zipfile.BadZipFile(f"{member.filename} is outside of src/")
+
+            target = os.path.join(srcdir, *parts)
+            # A symlink extracted earlier could still point it somewhere else
+            if os.path.commonpath([root, os.path.realpath(target)]) != root:
+                raise zipfile.BadZipFile(f"{member.filename} is outside of src/")
+
+            # unzip -n, existing files are kept
+            if not member.is_dir() and os.path.lexists(target):
+                continue
+
+            mode = member.external_attr >> 16
+            if stat.S_ISLNK(mode):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.symlink(os.fsdecode(archive.read(member)), target)
+                continue
+
+            extracted = archive.extract(member, srcdir)
+            if mode & 0o7777 and not member.is_dir():
+                os.chmod(extracted, mode & 0o7777)
+
+
+def unpack(apkbuild: APKBUILD, directory: str) -> int | None:
+    if apkbuild.unpack is not None:
+        return None
+
+    files = sources(apkbuild, directory)
+    if any(x.path.endswith(UNSUPPORTED) for x in files):
+        return None
+
+    # default_unpack verifies the checksums first, anything that doesn't match
+    # is left to abuild to report
+    if not _verified(apkbuild, files):
+        return None
+
+    srcdir = os.path.join(directory, "src")
+    os.makedirs(srcdir, exist_ok=True)
+    with trace.span("unpack", "host", package=apkbuild.pkgname):
+        # Archives are extracted one at a time and in order, later ones
+        # overwrite files from earlier ones like they do with abuild
+        for source in files:
+            mode = _mode(source.path)
+            if mode is None and not source.path.endswith(".zip"):
+                continue
+
+            print(f">>> {apkbuild.pkgname}: Unpacking {source.path}...")
+            try:
+                if mode is None:
+                    _extract_zip(source.path, srcdir)
+
+                else:
+                    with tarfile.open(
+                        source.path, mode, bufsize=1024 * 1024
+                    ) as archive:
+                        archive.extractall(srcdir, filter="tar")
+
+            except PermissionError:
+                # src/ was created by root in the builder container
+                return None
+
+            except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+                print(
+                    f">>> ERROR: {apkbuild.pkgname}: Failed to unpack {source.name}: {e}"
+                )
+                return 1
+
+    return 0
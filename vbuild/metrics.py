@@ -0,0 +1,208 @@
+import fcntl
+import json
+import math
+import os
+import tempfile
+from typing import cast
+
+from . import trace
+
+DURATION_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, math.inf]
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, math.inf]
+BUCKETS = {
+    "vbuild_stage_duration_seconds": DURATION_BUCKETS,
+    "vbuild_container_start_seconds": LATENCY_BUCKETS,
+    "vbuild_image_pull_seconds": DURATION_BUCKETS,
+}
+
+HELP = {
+    "vbuild_builds_total": ("counter", "vbuild commands run, by result"),
+    "vbuild_stages_total": ("counter", "abuild stages run, by result"),
+    "vbuild_stage_duration_seconds": (
+        "histogram",
+        "Time taken by each abuild stage",
+    ),
+    "vbuild_container_start_seconds": (
+        "histogram",
+        "Time taken to start a builder container",
+    ),
+    "vbuild_image_pull_seconds": ("histogram", "Time taken to pull the builder"),
+    "vbuild_image_pull_bytes_total": ("counter", "Bytes pulled for the builder"),
+    "vbuild_bash_calls_total": ("counter", "bash subprocesses spawned"),
+    "vbuild_bash_seconds_total": ("counter", "Time spent in bash subprocesses"),
+    "vbuild_cache_requests_total": ("counter", "Cache lookups, by cache and result"),
+}
+
+METRICS_PATH = os.environ.get("VBUILD_METRICS")
+
+# Set by enable(), None when metrics are disabled
+path: str | None = None
+counters: dict[str, float] = {}
+histograms: dict[str, list[float]] = {}
+
+
+def _key(name: str, labels: dict[str, str]) -> str:
+    return json.dumps([name, labels], sort_keys=True)
+
+
+def inc(name: str, value: float = 1, /, **labels: str) -> None:
+    if path is None:
+        return
+
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, /, **labels: str) -> None:
+    if path is None:
+        return
+
+    buckets = BUCKETS[name]
+    key = _key(name, labels)
+    # Cumulative bucket counts, followed by the sum
+    data = histograms.setdefault(key, [0] * (len(buckets) + 1))
+    for index, bucket in enumerate(buckets):
+        if value <= bucket:
+            data[index] += 1
+
+    data[-1] += value
+
+
+def _on_span(
+    name: str, category: str, duration: float, args: dict[str, object]
+) -> None:
+    match name, category:
+        case "bash", "subprocess":
+            inc("vbuild_bash_calls_total")
+            inc("vbuild_bash_seconds_total", duration)
+
+        case "abuild", "stage":
+            labels = {
+                "package": str(args.get("package")),
+                "arch": str(args.get("arch")),
+                "stage": str(args.get("stage")),
+            }
+            inc(
+                "vbuild_stages_total",
+                result="success" if args.get("returncode") == 0 else "failure",
+                **labels,
+            )
+            observe("vbuild_stage_duration_seconds", duration, **labels)
+
+        case "container.start", _:
+            observe("vbuild_container_start_seconds", duration)
+
+        case "pull", _:
+            observe("vbuild_image_pull_seconds", duration)
+            inc("vbuild_image_pull_bytes_total", cast(int, args.get("bytes", 0)))
+
+        case _, "command":
+            inc(
+                "vbuild_builds_total",
+                command=name.split(" ", 1)[-1],
+                result="success" if args.get("returncode") == 0 else "failure",
+            )
+
+        case _:
+            pass
+
+
+def enable(metrics_path: str) -> None:
+    global path
+    path = metrics_path
+    trace.listen(_on_span)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str], **extra: str) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+
+    return (
+        "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+    )
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(
+    counters: dict[str, float],
+    histograms: dict[str, list[float]],
+) -> str:
+    families: dict[str, list[str]] = {}
+    for key, value in sorted(counters.items()):
+        name, labels = cast(tuple[str, dict[str, str]], json.loads(key))
+        families.setdefault(name, []).append(
+            f"{name}{_labels(labels)} {_number(value)}"
+        )
+
+    for key, data in sorted(histograms.items()):
+        name, labels = cast(tuple[str, dict[str, str]], json.loads(key))
+        buckets = BUCKETS[name]
+        lines = families.setdefault(name, [])
+        for bucket, count in zip(buckets, data, strict=False):
+            lines.append(
+                f"{name}_bucket{_labels(labels, le=_number(bucket))} {_number(count)}"
+            )
+
+        lines.append(f"{name}_count{_labels(labels)} {_number(data[-2])}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(data[-1])}")
+
+    output: list[str] = []
+    for name, lines in families.items():
+        metric_type, description = HELP.get(name, ("untyped", ""))
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(lines)
+
+    return "\n".join(output) + "\n"
+
+
+def save() -> None:
+    if path is None:
+        return
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Totals from previous runs, node_exporter expects counters to only go up
+    with open(f"{path}.json", "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        _ = f.seek(0)
+        data = f.read()
+        state = cast(
+            dict[str, dict[str, float | list[float]]],
+            json.loads(data) if data else {"counters": {}, "histograms": {}},
+        )
+        total_counters = cast(dict[str, float], state["counters"])
+        for key, value in counters.items():
+            total_counters[key] = total_counters.get(key, 0) + value
+
+        total_histograms = cast(dict[str, list[float]], state["histograms"])
+        for key, values in histograms.items():
+            previous = total_histograms.get(key, [0] * len(values))
+            total_histograms[key] = [
+                a + b for a, b in zip(previous, values, strict=True)
+            ]
+
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, prefix=".vbuild-metrics", delete=False
+        ) as out:
+            _ = out.write(render(total_counters, total_histograms))
+
+        os.chmod(out.name, 0o644)
+        os.replace(out.name, path)
+        _ = f.seek(0)
+        _ = f.truncate()
+        json.dump(state, f)
+
+    counters.clear()
+    histograms.clear()
@@ -0,0 +1,212 @@
+import json
+import struct
+from typing import (
+    Any,
+    cast,
+)
+
+from . import bash
+from .velbuild import (
+    INSTALL_FUNCTION_NAME_MAP,
+    VELBUILD,
+)
+
+FORMAT = "vbuild-model"
+VERSION = 1
+MAGIC = b"VBM\0"
+
+Model = dict[str, Any]  # pyright: ignore[reportExplicitAny]
+Value = str | list["Value"] | dict[str, "Value"] | None
+
+_NONE = b"N"
+_STR = b"S"
+_LIST = b"L"
+_DICT = b"D"
+# Models nest a few levels deep, anything deeper is not a model
+MAX_DEPTH = 32
+
+
+class ModelError(Exception):
+    pass
+
+
+def model(velbuild: VELBUILD) -> Model:
+    return {
+        "format": FORMAT,
+        "version": VERSION,
+        "variables": dict(velbuild.variables),
+        "functions": dict(velbuild.functions),
+        "subpackages": velbuild.subpackages,
+        "subpackage_triggers": velbuild.subpackage_triggers,
+        "lifecycle": {
+            name: src
+            for name in [*INSTALL_FUNCTION_NAME_MAP.keys(), "trigger"]
+            if (src := cast(str | None, getattr(velbuild, name))) is not None
+        },
+        "options": velbuild.options,
+        "install": velbuild.install,
+    }
+
+
+def load(data: Model) -> VELBUILD:
+    if data.get("format") != FORMAT:
+        raise ModelError("Not a vbuild model")
+
+    if data.get("version") != VERSION:
+        raise ModelError(f"Unsupported model version {data.get('version')}")
+
+    variables = data.get("variables")
+    functions = data.get("functions")
+    subpackages = data.get("subpackages")
+    triggers = data.get("subpackage_triggers")
+    if (
+        not isinstance(variables, dict)
+        or not isinstance(functions, dict)
+        or not isinstance(subpackages, dict)
+        or not isinstance(triggers, list)
+    ):
+        raise ModelError("Invalid model")
+
+    # Use the expanded values instead of running bash again to compute them
+    return VELBUILD.from_views(
+        cast(bash.Variables, variables),
+        cast(bash.Functions, functions),
+        {"subpackages": subpackages, "subpackage_triggers": triggers},
+    )
+
+
+def to_json(velbuild: VELBUILD) -> str:
+    return json.dumps(model(velbuild), separators=(",", ":"))
+
+
+def from_json(data: str | bytes) -> VELBUILD:
+    try:
+        value = cast(object, json.loads(data))
+
+    except (ValueError, RecursionError) as e:
+        raise ModelError(f"Invalid model: {e}") from e
+
+    if not isinstance(value, dict):
+        raise ModelError("Invalid model")
+
+    return load(cast(Model, value))
+
+
+def _encode_length(length: int, out: bytearray) -> None:
+    # LEB128, most lengths fit in a single byte
+    while length >= 0x80:
+        out.append((length & 0x7F) | 0x80)
+        length >>= 7
+
+    out.append(length)
+
+
+def _decode_length(data: memoryview, offset: int) -> tuple[int, int]:
+    length = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ModelError("Truncated model")
+
+        byte = data[offset]
+        offset += 1
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return length, offset
+
+        shift += 7
+
+
+def _encode(value: Value, out: bytearray) -> None:
+    if value is None:
+        out += _NONE
+
+    elif isinstance(value, str):
+        data = value.encode()
+        out += _STR
+        _encode_length(len(data), out)
+        out += data
+
+    elif isinstance(value, list):
+        out += _LIST
+        _encode_length(len(value), out)
+        for item in value:
+            _encode(item, out)
+
+    elif isinstance(value, dict):  # pyright: ignore[reportUnnecessaryIsInstance]
+        out += _DICT
+        _encode_length(len(value), out)
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+
+    else:
+        raise ModelError(f"Unsupported type {type(value)}")
+
+
+def _decode(data: memoryview, offset: int, depth: int = 0) -> tuple[Value, int]:
+    if depth > MAX_DEPTH:
+        raise ModelError("Model is nested too deeply")
+
+    tag = bytes(data[offset : offset + 1])
+    offset += 1
+    if tag == _NONE:
+        return None, offset
+
+    length, offset = _decode_length(data, offset)
+    match tag:
+        case b"S":
+            end = offset + length
+            if end > len(data):
+                raise ModelError("Truncated model")
+
+            try:
+                return str(data[offset:end], "utf-8"), end
+
+            except UnicodeDecodeError as e:
+                raise ModelError(f"Invalid string at offset {offset}: {e}") from e
+
+        case b"L":
+            items: list[Value] = []
+            for _ in range(length):
+                item, offset = _decode(data, offset, depth + 1)
+                items.append(item)
+
+            return items, offset
+
+        case b"D":
+            mapping: dict[str, Value] = {}
+            for _ in range(length):
+                key, offset = _decode(data, offset, depth + 1)
+                if not isinstance(key, str):
+                    raise ModelError("Dictionary keys must be strings")
+
+                mapping[key], offset = _decode(data, offset, depth + 1)
+
+            return mapping, offset
+
+        case _:
+            raise ModelError(f"Unknown tag {tag!r} at offset {offset - 1}")
+
+
+def to_bytes(velbuild: VELBUILD) -> bytes:
+    data = model(velbuild)
+    out = bytearray(MAGIC)
+    out += struct.pack(">H", VERSION)
+    _encode({k: v for k, v in data.items() if k not in ("format", "version")}, out)
+    return bytes(out)
+
+
+def from_bytes(data: bytes) -> VELBUILD:
+    if not data.startswith(MAGIC):
+        raise ModelError("Not a vbuild model")
+
+    if len(data) < len(MAGIC) + 2:
+        raise ModelError("Truncated model")
+
+    (version,) = cast(tuple[int], struct.unpack_from(">H", data, len(MAGIC)))
+    value, end = _decode(memoryview(data), len(MAGIC) + 2)
+    if end != len(data) or not isinstance(value, dict):
+        raise ModelError("Invalid model")
+
+    return load({"format": FORMAT, "version": version, **value})
@@ -0,0 +1,123 @@
+import cProfile
+import os
+import pstats
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# cprofile[:path] or sample[:path], unset to disable profiling
+PROFILE = os.environ.get("VBUILD_PROFILE", "")
+PROFILE_TOP = int(os.environ.get("VBUILD_PROFILE_TOP", "25"))
+
+_profiler: cProfile.Profile | None = None
+# Where profile() writes the pstats file, the per command files go next to it
+_path: str | None = None
+_paths: list[str] = []
+
+
+def options() -> tuple[str, str] | None:
+    if not PROFILE:
+        return None
+
+    mode, _, path = PROFILE.partition(":")
+    if mode not in ("cprofile", "sample"):
+        print(
+            f">>> Unknown profiler {mode}, expected cprofile or sample", file=sys.stderr
+        )
+        return None
+
+    if not path:
+        path = "vbuild.prof" if mode == "cprofile" else "vbuild-profile.html"
+
+    return mode, path
+
+
+def _sampler() -> Any | None:  # pyright: ignore[reportExplicitAny]
+    try:
+        from pyinstrument import Profiler  # pyright: ignore[reportMissingImports]  # noqa: PLC0415
+
+    except ImportError:
+        print(
+            ">>> pyinstrument is not installed, falling back to cprofile",
+            file=sys.stderr,
+        )
+        return None
+
+    return Profiler()  # pyright: ignore[reportUnknownVariableType]
+
+
+def summary(path: str, top: int = PROFILE_TOP) -> None:
+    print(f">>> Hottest functions, full profile in {path}:", file=sys.stderr)
+    stats = pstats.Stats(path, stream=sys.stderr)
+    _ = stats.strip_dirs().sort_stats(pstats.SortKey.TIME).print_stats(top)
+
+
+@contextmanager
+def profile() -> Iterator[None]:
+    global _profiler, _path
+    found = options()
+    if found is None:
+        yield
+        return
+
+    mode, path = found
+    if mode == "sample":
+        sampler = _sampler()
+        if sampler is not None:
+            sampler.start()  # pyright: ignore[reportAny]
+            try:
+                yield
+
+            finally:
+                _ = sampler.stop()  # pyright: ignore[reportAny]
+                with open(path, "w") as f:
+                    _ = f.write(sampler.output_html())  # pyright: ignore[reportAny]
+
+                print(sampler.output_text(), file=sys.stderr)  # pyright: ignore[reportAny]
+                print(f">>> Sampling profile written to {path}", file=sys.stderr)
+
+            return
+
+        path = f"{os.path.splitext(path)[0]}.prof"
+
+    _profiler = cProfile.Profile()
+    _path = path
+    _paths.clear()
+    _profiler.enable()
+    try:
+        yield
+
+    finally:
+        _profiler.disable()
+        stats = pstats.Stats(_profiler)
+        for command_path in _paths:
+            _ = stats.add(command_path)
+
+        stats.dump_stats(path)
+        _profiler = None
+        _path = None
+        summary(path)
+
+
+@contextmanager
+def command(name: str) -> Iterator[None]:
+    if _profiler is None or _path is None:
+        yield
+        return
+
+    # Only one profiler can be active at a time, so pause the one for the whole
+    # run and merge this one back into it afterwards
+    base, ext = os.path.splitext(_path)
+    path = f"{base}.{name}{ext or '.prof'}"
+    _profiler.disable()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        _paths.append(path)
+        _profiler.enable()
@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+from hashlib import sha256
+from typing import cast
+
+from .apkbuild import APKBUILD
+from .context import digest
+
+# Stages run by vbuild all, in order
+STAGES = [
+    "gen",
+    "validate",
+    "clean",
+    "fetch",
+    "unpack",
+    "prepare",
+    "build",
+    "check",
+    "rootpkg",
+]
+
+
+# Stamps of the stages whose output in src/ is kept by --incremental, relative
+# to the package directory
+STAMP_DIR = ".vbuild"
+INCREMENTAL_STAGES = ["unpack", "prepare", "build"]
+# Stages of the last vbuild all that succeeded, used by --resume
+STATE_FILE = "state.json"
+
+
+def patches(apkbuild: APKBUILD) -> list[str]:
+    return [x for x in apkbuild.source or [] if x.split("::", 1)[0].endswith(".patch")]
+
+
+def skip_reason(apkbuild: APKBUILD, stage: str) -> str | None:
+    # Why abuild would do nothing for this stage, None if it has work to do
+    match stage:
+        case "fetch":
+            if not apkbuild.source:
+                return "source is empty"
+
+        case "prepare":
+            if apkbuild.prepare is None and not patches(apkbuild):
+                return "no prepare() function and no patches in source"
+
+        case "build":
+            if apkbuild.build is None:
+                return "no build() function"
+
+        case "check":
+            if "!check" in (apkbuild.options or []):
+                return "!check is set in options"
+
+            if apkbuild.check is None:
+                return "no check() function"
+
+        case _:
+            pass
+
+    return None
+
+
+def fingerprint(apkbuild: APKBUILD, stage: str) -> str:
+    # Each stage also depends on the inputs of the ones before it
+    inputs: dict[str, object] = {
+        "source": apkbuild.source,
+        "sha512sums": apkbuild.sha512sums,
+    }
+    if stage in ("prepare", "build"):
+        inputs["patches"] = patches(apkbuild)
+        inputs["builddir"] = apkbuild.variables.get("builddir", None)
+        inputs["prepare"] = apkbuild.prepare
+
+    if stage == "build":
+        inputs["build"] = apkbuild.build
+        inputs["makedepends"] = apkbuild.makedepends
+
+    return sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _stamp_path(directory: str, stage: str) -> str:
+    return os.path.join(directory, STAMP_DIR, stage)
+
+
+def stamp(apkbuild: APKBUILD, directory: str, stage: str) -> None:
+    path = _stamp_path(directory, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        _ = f.write(fingerprint(apkbuild, stage))
+
+
+def clear_stamps(directory: str) -> None:
+    shutil.rmtree(os.path.join(directory, STAMP_DIR), ignore_errors=True)
+
+
+def _stamped(apkbuild: APKBUILD, directory: str, stage: str) -> bool:
+    path = _stamp_path(directory, stage)
+    if not os.path.exists(path):
+        return False
+
+    with open(path) as f:
+        return f.read() == fingerprint(apkbuild, stage)
+
+
+def up_to_date(apkbuild: APKBUILD, directory: str) -> list[str]:
+    # Stages that don't need to run again because src/ still holds their
+    # output. prepare changes src/, so it can only run again after a new
+    # clean and unpack.
+    if not os.path.isdir(os.path.join(directory, "src")) or not _stamped(
+        apkbuild, directory, "unpack"
+    ):
+        return []
+
+    if skip_reason(apkbuild, "prepare") is None and not _stamped(
+        apkbuild, directory, "prepare"
+    ):
+        return []
+
+    stages = ["clean", "fetch", "unpack", "prepare"]
+    if skip_reason(apkbuild, "build") is None and _stamped(
+        apkbuild, directory, "build"
+    ):
+        stages.append("build")
+
+    return stages
+
+
+def _hashes(directory: str) -> dict[str, str | None]:
+    return {
+        "velbuild": digest(os.path.join(directory, "VELBUILD")),
+        "apkbuild": digest(os.path.join(directory, "APKBUILD")),
+    }
+
+
+def save_state(directory: str, completed: list[str]) -> None:
+    path = os.path.join(directory, STAMP_DIR, STATE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({**_hashes(directory), "completed": completed}, f)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def load_state(directory: str) -> list[str] | None:
+    # None when there is no state, or the VELBUILD or APKBUILD changed since
+    # it was saved
+    path = os.path.join(directory, STAMP_DIR, STATE_FILE)
+    try:
+        with open(path) as f:
+            state = cast(dict[str, object], json.load(f))
+
+    except (OSError, ValueError):
+        return None
+
+    hashes = _hashes(directory)
+    if any(state.get(k) != v for k, v in hashes.items()):
+        return None
+
+    return cast(list[str], state.get("completed", []))
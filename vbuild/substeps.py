@@ -0,0 +1,98 @@
+import re
+import sys
+import time
+from typing import TextIO
+
+MARKER = re.compile(r"^>>> (?P<package>[^:\s]+): (?P<message>.+)$")
+SUBSTEPS: list[tuple[re.Pattern[str], str]] = [
+    (re.compile(r"^Fetching "), "fetching"),
+    (re.compile(r"^Checking \w+sums"), "verifying checksums"),
+    (re.compile(r"^Unpacking "), "unpacking"),
+    (re.compile(r"^Installing for (build|host)"), "installing makedepends"),
+    (re.compile(r"^Building "), "build"),
+    (re.compile(r"^Running postcheck"), "postcheck"),
+    (re.compile(r"^Entering fakeroot"), "package"),
+    (re.compile(r"^Running split function"), "packaging subpackages"),
+    (
+        re.compile(
+            r"^(Preparing (sub)?package|Tracing dependencies|Package size|Compressing data|Create )"
+        ),
+        "creating packages",
+    ),
+    (re.compile(r"^(Signing|Updating the .*index)"), "signing"),
+    (re.compile(r"^Cleaning up"), "cleaning up"),
+    (re.compile(r"^Uninstalling dependencies"), "uninstalling makedepends"),
+]
+
+
+class Substep:
+    __slots__: tuple[str, ...] = ("duration", "name", "package", "stage")
+
+    def __init__(self, package: str, stage: str, name: str, duration: float) -> None:
+        self.package: str = package
+        self.stage: str = stage
+        self.name: str = name
+        self.duration: float = duration
+
+    def __repr__(self) -> str:
+        return f"Substep({self.package!r}, {self.stage!r}, {self.name!r}, {self.duration:.3f})"
+
+
+def classify(message: str) -> str | None:
+    for pattern, name in SUBSTEPS:
+        if pattern.match(message):
+            return name
+
+    return None
+
+
+class SubstepTimer:
+    def __init__(self, package: str, stage: str) -> None:
+        self.package: str = package
+        self.stage: str = stage
+        self.substeps: list[Substep] = []
+        self._current: str = stage
+        self._started: float = time.monotonic()
+
+    def _switch(self, name: str, now: float) -> None:
+        if name == self._current:
+            return
+
+        self.substeps.append(
+            Substep(self.package, self.stage, self._current, now - self._started)
+        )
+
+        self._current = name
+        self._started = now
+
+    def feed(self, line: str) -> None:
+        match = MARKER.match(line.strip())
+        if match is None:
+            return
+
+        name = classify(match.group("message"))
+        if name is not None:
+            self._switch(name, time.monotonic())
+
+    def finish(self) -> list[Substep]:
+        self._switch("", time.monotonic())
+        return self.substeps
+
+
+def summary(substeps: list[Substep], file: TextIO = sys.stderr) -> None:
+    totals: dict[tuple[str, str], float] = {}
+    for substep in substeps:
+        key = (substep.stage, substep.name)
+        totals[key] = totals.get(key, 0.0) + substep.duration
+
+    if not totals:
+        return
+
+    stage_width = max(len(stage) for stage, _ in totals)
+    name_width = max(len(name) for _, name in totals)
+    print(">>> Time spent in each abuild step:", file=file)
+    for (stage, name), duration in totals.items():
+        print(
+            f"    {stage:<{stage_width}}  {name:<{name_width}}  {duration:8.1f} s",
+            file=file,
+        )
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from types import TracebackType
+from typing import (
+    Any,
+    Self,
+)
+
+# Chrome trace-event format, can be opened with https://ui.perfetto.dev or
+# chrome://tracing. None when tracing is disabled.
+events: list[dict[str, Any]] | None = None  # pyright: ignore[reportExplicitAny]
+# Called with the name, category, duration in seconds and arguments of every
+# finished span
+listeners: list[Callable[[str, str, float, dict[str, object]], None]] = []
+_origin = time.perf_counter_ns()
+
+
+class Span:
+    __slots__: tuple[str, ...] = ("args", "category", "name", "start")
+
+    def __init__(self, name: str, category: str, args: dict[str, object]) -> None:
+        self.name: str = name
+        self.category: str = category
+        self.args: dict[str, object] = args
+        self.start: int = 0
+
+    def __enter__(self) -> Self:
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+
+        for listener in listeners:
+            listener(self.name, self.category, (end - self.start) / 1e9, self.args)
+
+        if events is not None:
+            events.append(
+                {
+                    "name": self.name,
+                    "cat": self.category,
+                    "ph": "X",
+                    "ts": (self.start - _origin) / 1000,
+                    "dur": (end - self.start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_native_id(),
+                    "args": self.args,
+                }
+            )
+
+    def set(self, **args: object) -> None:
+        self.args.update(args)
+
+
+class NoSpan:
+    __slots__: tuple[str, ...] = ()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        pass
+
+    def set(self, **_: object) -> None:
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def enable() -> None:
+    global events
+    if events is None:
+        events = []
+
+
+def enabled() -> bool:
+    return events is not None
+
+
+def span(name: str, category: str = "vbuild", **args: object) -> Span | NoSpan:
+    if events is None and not listeners:
+        return NO_SPAN
+
+    return Span(name, category, args)
+
+
+def listen(listener: Callable[[str, str, float, dict[str, object]], None]) -> None:
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def unlisten(listener: Callable[[str, str, float, dict[str, object]], None]) -> None:
+    if listener in listeners:
+        listeners.remove(listener)
+
+
+def save(path: str) -> None:
+    assert events is not None
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
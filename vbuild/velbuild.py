@@ -3,8 +3,11 @@ from collections.abc import (
     Callable,
     Generator,
 )
+from concurrent.futures import ThreadPoolExecutor
 from inspect import cleandoc
 from typing import (
+    Literal,
+    TextIO,
     cast,
     override,
 )
@@ -19,16 +22,21 @@ from urllib.request import (
 from . import (
     bash,
     containers,
+    trace,
 )
 from .apkbuild import (
     APKBUILD,
     APKBUILD_AUTOMATIC_VARIABLES,
     APKBUILD_VARIABLES,
     ErrorType,
+    Line,
     Property,
+    cached_value,
     is_type,
     put_variables,
     quoted_string,
+    quoted_strings,
+    store_value,
     typed_property,
 )
 
@@ -62,23 +70,29 @@ class URLValidationError(Exception):
     pass
 
 
+# Result of every URL checked by this process, None if it was valid
+url_cache: dict[str, URLValidationError | URLError | None] = {}
+
+
 def string_array_property_always(
     func: Callable[..., list[str]],
 ) -> Property[list[str]]:
     name = func.__name__
 
     def fget(self: "APKBUILD") -> list[str]:
-        value = self.variables.get(name, None)
-        assert is_type(value, str | None), f"Cannot get {name}, value is not valid"
-        if value is None:
-            return func(self, [])
-
-        assert isinstance(value, str)
-        return func(self, value.split())
+        return cached_value(
+            self,
+            fget,
+            name,
+            str | None,
+            lambda x: func(self, [] if x is None else cast(str, x).split()),
+        )
 
     def fset(self: "APKBUILD", value: list[str]) -> None:
         assert is_type(value, list[str]), f"Cannot set {name}, value is not valid"
-        self.variables[name] = f"\n{'\n'.join(value)}\n"
+        store_value(
+            self, fget, name, f"\n{'\n'.join(value)}\n", func(self, list(value))
+        )
 
     def fdel(self: "APKBUILD") -> None:
         del self.variables[name]
@@ -87,9 +101,21 @@ def string_array_property_always(
 
 
 class VELBUILD(APKBUILD):
-    @APKBUILD.text.getter
-    def text(self) -> str:
-        lines: list[str] = []
+    runtime: Literal["podman", "docker"] | None = None
+
+    @override
+    def render(self, fp: TextIO) -> None:
+        with trace.span(
+            "render", "render", package=self.variables.get("pkgname")
+        ) as span:
+            size = 0
+            for chunk in self.chunks():
+                size += fp.write(chunk)
+
+            span.set(bytes=size)
+
+    @override
+    def _lines(self) -> Generator[Line]:
         variables = self.variables.copy()
         for name, value in variables.items():
             if (
@@ -112,63 +138,41 @@ class VELBUILD(APKBUILD):
                 continue
 
             if isinstance(value, str):
-                lines.append(f"{name}={quoted_string(value)}")
+                yield f"{name}={quoted_string(value)}"
 
             elif isinstance(value, list):
-                lines.append(f"{name}=(")
-                for x in value:
-                    if x is not None:
-                        lines.append(f"  {quoted_string(x)}")
-
-                lines.append(")")
+                yield f"{name}=("
+                yield from (f"  {x}" for x in quoted_strings(value))
+                yield ")"
 
             elif isinstance(value, dict):  # pyright: ignore[reportUnnecessaryIsInstance]
-                lines.append(f"{name}=(")
+                yield f"{name}=("
                 for k, v in value.items():
-                    lines.append(f"  [{k}]={quoted_string(v)}")
+                    yield f"  [{k}]={quoted_string(v)}"
 
-                lines.append(")")
+                yield ")"
 
         options = set(self.options)
         if self.image is not None:
             options |= {"!strip"}
 
-        lines.append(f"options={quoted_string(f'\n{"\n".join(sorted(options))}\n')}")
+        yield f"options={quoted_string(f'\n{"\n".join(sorted(options))}\n')}"
         if self.install.strip():
-            lines.append(f"install={quoted_string(self.install)}")
+            yield f"install={quoted_string(self.install)}"
 
         triggers: list[str] = []
         if self.triggers:
             triggers.append(f"{self.pkgname}.trigger={':'.join(self.triggers)}")
 
-        subpackage_map = self._subpackages
-        for sub_name, sub_func_name in subpackage_map.items():
-            sub_vars, sub_funcs = bash.parse(
-                self.functions[sub_func_name], APKBUILD_AUTOMATIC_VARIABLES
-            )
-            if "trigger" not in sub_funcs or "triggers" not in sub_vars:
-                continue
-
-            triggers.append(
-                f"{sub_name}.trigger={':'.join(x for x in cast(str, sub_vars['triggers']).split() if x)}"
-            )
-
+        triggers.extend(self.subpackage_triggers)
         if triggers:
-            lines.append(f"triggers={quoted_string(f'\n{"\n".join(triggers)}\n')}")
+            yield f"triggers={quoted_string(f'\n{"\n".join(triggers)}\n')}"
 
+        subpackage_map = self._subpackages
         functions = self.functions.copy()
         if "package" not in functions:
             functions["package"] = "\n"
 
-        runtime = containers.runtime()
-        assert runtime is not None
-        match runtime:
-            case "podman":
-                runtime += " --remote"
-
-            case "docker":
-                pass
-
         tab = " " * 4
         subpackage_functions = subpackage_map.values()
         for name, value in functions.items():
@@ -183,6 +187,15 @@ class VELBUILD(APKBUILD):
                 continue
 
             elif name == "build" and self.image is not None:
+                runtime = self.runtime or containers.runtime()
+                assert runtime is not None
+                match runtime:
+                    case "podman":
+                        runtime += " --remote"
+
+                    case "docker":
+                        pass
+
                 keys = sorted(
                     set(APKBUILD_VARIABLES + list(variables.keys()))
                     - bash.DEFAULT_VARIABLE_NAMES
@@ -227,22 +240,36 @@ class VELBUILD(APKBUILD):
                     unit_name = os.path.basename(unit)
                     value += f'{tab}install -Dm644 "$srcdir/{unit}" "$pkgdir/home/root/.vellum/share/{self.pkgname}/{unit_name}";\n'  # noqa: PLW2901
 
-            lines.append(f"{name}() {{{value}}}")
+            yield (f"{name}() {{", value, "}")
 
         for name, value in self.subpackages.items():
-            lines.append(f"{subpackage_map[name]}() {{{value}}}")
+            yield (f"{subpackage_map[name]}() {{", value, "}")
 
         if "sha512sums" in variables:
             value = variables["sha512sums"]
             assert isinstance(value, str)
-            lines.append(f"sha512sums={quoted_string(value)}")
-
-        return "\n".join(lines)
+            yield f"sha512sums={quoted_string(value)}"
 
     def save(self, path: str) -> None:
         assert isinstance(self.pkgname, str)
-        with open(os.path.join(path, "APKBUILD"), "w") as f:
-            _ = f.write(self.text + "\n")
+        with trace.span("save", "render", package=self.pkgname):
+            self._save(path)
+
+    def _save(self, path: str) -> None:
+        assert isinstance(self.pkgname, str)
+        # Rendering can still fail part way through, only replace the APKBUILD
+        # once all of it has been written
+        apkbuild = os.path.join(path, "APKBUILD")
+        try:
+            with open(f"{apkbuild}.tmp", "w") as f:
+                self.render(f)
+                _ = f.write("\n")
+
+        except BaseException:
+            os.unlink(f"{apkbuild}.tmp")
+            raise
+
+        os.replace(f"{apkbuild}.tmp", apkbuild)
 
         for name, functionName in INSTALL_FUNCTION_NAME_MAP.items():
             src = getattr(self, name)  # pyright: ignore[reportAny]
@@ -379,18 +406,45 @@ class VELBUILD(APKBUILD):
         if url is None:
             return
 
+        if url in url_cache:
+            error = url_cache[url]
+            if error is not None:
+                raise error
+
+            return
+
+        try:
+            self._check_url(url)
+            url_cache[url] = None
+
+        except (URLValidationError, URLError) as e:
+            url_cache[url] = e
+            raise
+
+    def _try_url(self, url: str) -> None:
+        try:
+            self._validate_url(url)
+
+        except (URLValidationError, URLError):
+            pass
+
+    def _check_url(self, url: str) -> None:
         parsed = urlparse(url)
         if parsed.scheme not in ("http", "https"):
             raise URLValidationError(f"Unsupported URL schema: {parsed.scheme}")
 
-        with build_opener(NonRaisingHTTPErrorProcessor).open(
-            Request(  # noqa: S310
-                url,
-                method="HEAD",
-                headers={"User-Agent": "vbuild"},
-            ),
-            timeout=10,
-        ) as res:  # pyright: ignore[reportAny]
+        with (
+            trace.span("url", "network", url=url) as span,
+            build_opener(NonRaisingHTTPErrorProcessor).open(
+                Request(  # noqa: S310
+                    url,
+                    method="HEAD",
+                    headers={"User-Agent": "vbuild"},
+                ),
+                timeout=10,
+            ) as res,  # pyright: ignore[reportAny]
+        ):
+            span.set(status=res.status)  # pyright: ignore[reportAny]
             if res.status >= 300 and res.status != 403:  # pyright: ignore[reportAny]
                 raise URLValidationError(f"Unexpected response code: {res.status}")  # pyright: ignore[reportAny]
 
@@ -408,6 +462,20 @@ class VELBUILD(APKBUILD):
         if self.category is None:
             yield ErrorType.Error, "category is not set"
 
+        # Check the URLs at the same time, the errors are raised again below
+        # from url_cache
+        urls = [
+            x
+            for x in dict.fromkeys(
+                [self.readmeurl, self.donateurl, self.changelogurl, self.url]
+            )
+            if x is not None and x not in url_cache
+        ]
+        if len(urls) > 1:
+            with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+                for _ in executor.map(self._try_url, urls):
+                    pass
+
         try:
             self._validate_url(self.readmeurl)
 
@@ -462,8 +530,7 @@ class VELBUILD(APKBUILD):
                 "triggers variable set but trigger function not defined",
             )
 
-        for name, body in super().subpackages.items():
-            sub_vars, sub_funcs = bash.parse(body, APKBUILD_AUTOMATIC_VARIABLES)
+        for name, (sub_vars, sub_funcs) in self._subpackage_bodies.items():
             if "package" not in sub_funcs:
                 yield (
                     ErrorType.Error,
@@ -484,14 +551,32 @@ class VELBUILD(APKBUILD):
                     f"subpackage {name}: trigger function defined but triggers variable not set",
                 )
 
+    @property
+    def _subpackage_bodies(self) -> dict[str, tuple[bash.Variables, bash.Functions]]:
+        # Each subpackage function parsed on its own, shared by the views below
+        return self._memo("_subpackage_bodies", self._parse_subpackage_bodies)
+
+    def _parse_subpackage_bodies(
+        self,
+    ) -> dict[str, tuple[bash.Variables, bash.Functions]]:
+        return {
+            name: bash.parse(body, APKBUILD_AUTOMATIC_VARIABLES)
+            for name, body in super().subpackages.items()
+        }
+
     @APKBUILD.subpackages.getter
     def subpackages(self) -> dict[str, str]:
+        return self._memo("subpackages", self._subpackage_functions).copy()
+
+    def _subpackage_functions(self) -> dict[str, str]:
         subpackages = super().subpackages
+        bodies = self._subpackage_bodies
         tab = " " * 4
         for name, body in subpackages.items():
             context = put_variables(self.variables)
             sub_vars, _ = bash.parse(context + body, APKBUILD_AUTOMATIC_VARIABLES)
-            expected_vars, sub_funcs = bash.parse(body, APKBUILD_AUTOMATIC_VARIABLES)
+            expected_vars = bodies[name][0].copy()
+            sub_funcs = bodies[name][1]
             systemdunits = [
                 x for x in cast(str, expected_vars.get("systemdunits", "")).split() if x
             ]
@@ -556,9 +641,28 @@ class VELBUILD(APKBUILD):
 
         return subpackages
 
+    @property
+    def subpackage_triggers(self) -> list[str]:
+        return list(self._memo("subpackage_triggers", self._subpackage_triggers))
+
+    def _subpackage_triggers(self) -> list[str]:
+        triggers: list[str] = []
+        for sub_name, (sub_vars, sub_funcs) in self._subpackage_bodies.items():
+            if "trigger" not in sub_funcs or "triggers" not in sub_vars:
+                continue
+
+            triggers.append(
+                f"{sub_name}.trigger={':'.join(x for x in cast(str, sub_vars['triggers']).split() if x)}"
+            )
+
+        return triggers
+
     @property
     @override
     def install(self) -> str:
+        return self._memo("install", self._install)
+
+    def _install(self) -> str:
         data: list[str] = []
         for name in INSTALL_FUNCTION_NAMES:
             if name in self.functions and name != "postosupgrade":
@@ -0,0 +1,134 @@
+import ctypes
+import os
+import select
+import struct
+import time
+from collections.abc import Iterator
+
+POLL_INTERVAL = float(os.environ.get("VBUILD_WATCH_INTERVAL", "0.5"))
+# Editors often save with several writes or a rename, wait for the events to
+# settle before reporting a change
+DEBOUNCE = 0.2
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event, followed by len bytes of the name
+EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    # Watches the directories that hold the paths, files are usually replaced
+    # by editors so a watch on the file itself would be lost
+    def __init__(self, paths: list[str]) -> None:
+        self._libc: ctypes.CDLL = ctypes.CDLL(None, use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_CLOEXEC)  # pyright: ignore[reportAny]
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._dirs: dict[int, str] = {}
+        self.paths: set[str] = set()
+        try:
+            self.watch(paths)
+
+        except OSError:
+            self.close()
+            raise
+
+    def watch(self, paths: list[str]) -> None:
+        self.paths = {os.path.abspath(x) for x in paths}
+        for directory in {os.path.dirname(x) for x in self.paths}:
+            if directory in self._dirs.values() or not os.path.isdir(directory):
+                continue
+
+            wd: int = self._libc.inotify_add_watch(  # pyright: ignore[reportAny]
+                self._fd, os.fsencode(directory), IN_MASK
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), directory)
+
+            self._dirs[wd] = directory
+
+    def _read(self) -> Iterator[str]:
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            directory = self._dirs.get(wd)
+            if directory is not None and name:
+                yield os.path.join(directory, os.fsdecode(name))
+
+    def wait(self) -> list[str]:
+        changed: set[str] = set()
+        timeout = None
+        while True:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if not ready:
+                return sorted(changed)
+
+            changed.update(x for x in self._read() if x in self.paths)
+            if changed:
+                timeout = DEBOUNCE
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _stat(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PollingWatcher:
+    def __init__(self, paths: list[str], interval: float = POLL_INTERVAL) -> None:
+        self.interval: float = interval
+        self._snapshot: dict[str, tuple[int, int] | None] = {}
+        self.paths: set[str] = set()
+        self.watch(paths)
+
+    def watch(self, paths: list[str]) -> None:
+        self.paths = {os.path.abspath(x) for x in paths}
+        # Paths that were already watched keep their old state, so a change
+        # made while a build was running is still picked up
+        self._snapshot = {
+            x: self._snapshot[x] if x in self._snapshot else _stat(x)
+            for x in self.paths
+        }
+
+    def wait(self) -> list[str]:
+        while True:
+            time.sleep(self.interval)
+            current = {x: _stat(x) for x in self.paths}
+            changed = [x for x in self.paths if current[x] != self._snapshot[x]]
+            self._snapshot = current
+            if changed:
+                return sorted(changed)
+
+    def close(self) -> None:
+        pass
+
+
+def watcher(paths: list[str], poll: bool = False) -> InotifyWatcher | PollingWatcher:
+    if not poll:
+        try:
+            return InotifyWatcher(paths)
+
+        except (OSError, AttributeError):
+            # No inotify on this system, or no watches left
+            pass
+
+    return PollingWatcher(paths)